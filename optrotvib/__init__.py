@@ -1,3 +1,15 @@
-from . import generate
-from . import molecule
-from . import findif
+import importlib
+
+# Submodules are imported on first access, so light entry points (like the orv.engine cli) do not pay for numpy,
+# jsonschema and the schema files
+_submodules = ["generate", "molecule", "findif", "stencil", "vibcorr", "hessian", "result_cache", "store"]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _submodules)
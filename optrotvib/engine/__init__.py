@@ -1 +0,0 @@
-from . import psi4_engine
@@ -0,0 +1,67 @@
+"""
+Storage of the large arrays (hessians, gradients) of a result, inline in output.json or as .npy sidecar files
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+# How arrays are stored, 'json' (inline shape/data lists) or 'npy' (sidecar file next to output.json)
+ARRAY_STORAGE_ENV = 'ORV_ARRAY_STORAGE'
+
+def storage_mode():
+    return os.environ.get(ARRAY_STORAGE_ENV, 'json').lower()
+
+def file_checksum(path):
+    m = hashlib.sha256()
+    with open(str(path), 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            m.update(block)
+    return m.hexdigest()
+
+def pack_field(arr, name, symmetric=False, directory='.', mode=None):
+    """
+    Packs `arr` into an ``array_data`` result field.
+
+    In 'json' mode the field holds the shape and the flattened data. In 'npy' mode the array is written to
+    ``<directory>/<name>.npy`` (only the upper triangle if `symmetric`) and the field holds the shape, the file name,
+    the packing and a sha256 checksum of the file.
+    """
+    arr = np.asarray(arr, dtype=float)
+    mode = storage_mode() if mode is None else mode
+    if mode == 'json':
+        return {'shape': list(arr.shape), 'data': arr.ravel().tolist()}
+    elif mode == 'npy':
+        packing = 'full'
+        data = arr
+        if symmetric:
+            packing = 'upper'
+            data = arr[np.triu_indices(arr.shape[0])]
+        file_name = "{}.npy".format(name)
+        file_path = Path(directory) / file_name
+        np.save(str(file_path), data)
+        return {'shape': list(arr.shape), 'file': file_name, 'packing': packing, 'sha256': file_checksum(file_path)}
+    else:
+        raise KeyError("Array storage mode '%s' not recognized." % mode)
+
+def unpack_field(field, directory='.', verify=False):
+    """
+    Rebuilds the array of an ``array_data`` result field, `directory` is where the result (and its sidecars) lives.
+
+    Sidecar arrays are memory mapped, a fully stored array is returned without being read into memory. With `verify`
+    the checksum of the sidecar file is checked first.
+    """
+    if 'file' not in field:
+        return np.array(field['data'], dtype=float).reshape(field['shape'])
+    file_path = Path(directory) / field['file']
+    if verify and file_checksum(file_path) != field['sha256']:
+        raise ValueError("Checksum mismatch for array file %s" % file_path)
+    data = np.load(str(file_path), mmap_mode='r')
+    if field.get('packing', 'full') == 'upper':
+        n = field['shape'][0]
+        full = np.zeros((n, n))
+        full[np.triu_indices(n)] = data
+        return full + np.triu(full, 1).T
+    return data.reshape(field['shape'])
@@ -0,0 +1,74 @@
+"""
+Startup benchmark for the orv.engine cli
+
+    python -m optrotvib.engine.bench_startup [--repeat N] [--budget SECONDS]
+
+Imports the cli in fresh interpreters, reports the best import and process wall times and exits non-zero if the
+import takes longer than the budget or pulls in any module that should only be loaded on first use.
+"""
+
+import argparse
+import json
+import subprocess as sp
+import sys
+import time
+
+# modules that must not be imported just by starting the cli
+HEAVY_MODULES = [
+        'numpy',
+        'jsonschema',
+        'psutil',
+        'cpuinfo',
+        'lxml',
+        'psi4',
+        'optrotvib.schema',
+        'optrotvib.molecule',
+        'optrotvib.engine.psi4_engine',
+        'optrotvib.engine.g09_engine'
+        ]
+
+_probe = """
+import time
+t_start = time.perf_counter()
+import optrotvib.engine.cli
+t_import = time.perf_counter() - t_start
+import json, sys
+print(json.dumps({'import': t_import, 'modules': sorted(sys.modules)}))
+"""
+
+def measure(repeat=5):
+    "best of `repeat` (import time, process wall time) in seconds, and the modules loaded by the import"
+    best_import = float('inf')
+    best_wall = float('inf')
+    modules = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        proc = sp.run([sys.executable, '-c', _probe], stdout=sp.PIPE, check=True, universal_newlines=True)
+        t_wall = time.perf_counter() - t_start
+        data = json.loads(proc.stdout)
+        best_import = min(best_import, data['import'])
+        best_wall = min(best_wall, t_wall)
+        modules = data['modules']
+    return best_import, best_wall, modules
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="orv.engine startup benchmark")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.1, help="maximum import time in seconds")
+    args = parser.parse_args(argv)
+
+    t_import, t_wall, modules = measure(args.repeat)
+    heavy = [m for m in HEAVY_MODULES if m in modules]
+    print("cli import: {:.1f} ms, process wall time: {:.1f} ms (best of {})".format(
+        t_import * 1000, t_wall * 1000, args.repeat))
+    ok = True
+    if heavy:
+        print("FAIL: imported at startup: {}".format(", ".join(heavy)))
+        ok = False
+    if t_import > args.budget:
+        print("FAIL: import time over budget of {:.1f} ms".format(args.budget * 1000))
+        ok = False
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,19 @@
+import importlib
 import json
+import os
+import sys
 from pathlib import Path
-import time
 from . import cpu_info
-from . import psi4_engine
-from . import g09_engine
+from . import instrument
+
+# program name -> engine module, imported only when a job for that program is run
+_engines = {
+        'psi4': 'psi4_engine',
+        'g09': 'g09_engine'
+        }
+
+def get_engine(program):
+    return importlib.import_module("." + _engines[program], __package__)
 
 def prepare():
     input_json = json.loads(Path('input.json').read_text())
@@ -17,29 +27,73 @@ def prepare():
     return input_json, output_json
 
 def wrap_compute_info(f, arg):
-    t_start = time.time()
-    output = f(arg)
-    t_end = time.time()
-    output['compute_info'] = {
+    "runs f(arg) as the 'engine' phase of the current recording, its compute_info is added by finish"
+    with instrument.phase('engine'):
+        return f(arg)
+
+def compute_info(summary):
+    ncpu = cpu_info.ncore()
+    info = {
             'cluster_name': cpu_info.cluster_name(),
             'hostname': cpu_info.hostname(),
-            'ncpu': cpu_info.ncore(),
+            'ncpu': ncpu,
             'memory': "{} MB".format(cpu_info.memory()),
-            'walltime': round(t_end - t_start)
             }
-    return output
+    info.update(summary)
+    return info
 
+def finish(output_json, job_dir='.'):
+    summary = instrument.stop(cpu_info.ncore())
+    if summary is not None:
+        # the recording ends here, writing output.json is not part of it
+        output_json['compute_info'] = compute_info(summary)
+    # compact, raw program output is kept in the raw store rather than in the result
+    text = json.dumps(output_json, separators=(',', ':'))
+    Path(Path(job_dir) / 'output.json').write_text(text)
 
-def finish(output_json):
-    Path('output.json').write_text(json.dumps(output_json, indent=4))
+def run_job_dirs(job_dirs):
+    """
+    Worker mode, runs the jobs in `job_dirs` one after the other in this process.
 
-def main():
-    input_json, output_json = prepare()
+    Engines with a ``run_many`` (psi4) set up once for all of their jobs, the others run each job from its directory.
+    """
+    by_program = {}
+    for job_dir in job_dirs:
+        job_dir = Path(job_dir).resolve()
+        program = json.loads(Path(job_dir / 'input.json').read_text())['modelchem']['program']
+        by_program.setdefault(program, []).append(job_dir)
+
+    for program, dirs in by_program.items():
+        if program in _engines and hasattr(get_engine(program), 'run_many'):
+            get_engine(program).run_many(dirs, finish)
+            continue
+        return_dir = Path.cwd()
+        for job_dir in dirs:
+            os.chdir(str(job_dir))
+            try:
+                main([])
+            finally:
+                os.chdir(str(return_dir))
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        run_job_dirs(argv)
+        return
+    instrument.start()
+    with instrument.phase('read_input'):
+        input_json, output_json = prepare()
     r_id = input_json.get('_id')
-    if input_json['modelchem']['program'] == 'psi4':
-        output_json = psi4_engine.run(input_json)
-    if input_json['modelchem']['program'] == 'g09':
-        output_json = g09_engine.run(input_json)
+    program = input_json['modelchem']['program']
+    if program in _engines:
+        with instrument.phase('import_engine'):
+            engine = get_engine(program)
+        output_json = wrap_compute_info(engine.run, input_json)
     else:
         output_json['raw_output']['error_message'] = "BAD PROG {}".format(input_json['modelchem']['program'])
-    Path('output.json').write_text(json.dumps(output_json))
+    output_json['_id'] = r_id
+    finish(output_json)
+
+if __name__ == '__main__':
+    main()
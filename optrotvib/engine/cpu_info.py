@@ -1,5 +1,3 @@
-import psutil
-import cpuinfo
 import socket
 import os
 
@@ -23,10 +21,207 @@ def cluster_name():
             return fulln
     return cn
 
+# Per job overrides, set by executors that run several jobs on one node
+NCORE_ENV = 'ORV_NCORE'
+MEMORY_ENV = 'ORV_MEMORY_MB'
+
+# fallback location of the cgroup files when /proc does not say where this process's cgroups are
+_CGROUP_ROOT = '/sys/fs/cgroup'
+_PROC_CGROUP = '/proc/self/cgroup'
+_PROC_MOUNTINFO = '/proc/self/mountinfo'
+
+def _read_first(*paths):
+    for path in paths:
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            continue
+    return None
+
+def _cgroup_dirs(controller):
+    """
+    Directories of this process's cgroup for a v1 `controller` ('cpu', 'memory') or the v2 hierarchy (None), from the
+    process's own cgroup (e.g. the one a PBS job runs in) up to the root of the mount.
+    """
+    key = '' if controller is None else controller
+    cgroup_text = _read_first(_PROC_CGROUP)
+    mount_text = _read_first(_PROC_MOUNTINFO)
+    if cgroup_text is None or mount_text is None:
+        fallback = _CGROUP_ROOT if controller is None else os.path.join(_CGROUP_ROOT, controller)
+        return [fallback]
+
+    # hierarchy-id:controller,list:path
+    path = None
+    for line in cgroup_text.splitlines():
+        _, controllers, cg_path = line.split(':', 2)
+        if (controller is None and controllers == '') or key in controllers.split(','):
+            path = cg_path
+            break
+    if path is None:
+        return []
+
+    # ... root mount_point ... - fstype source super_options
+    mount = None
+    for line in mount_text.splitlines():
+        fields, _, fs_fields = line.partition(' - ')
+        fields = fields.split()
+        fs_fields = fs_fields.split()
+        if len(fields) < 5 or len(fs_fields) < 3:
+            continue
+        if controller is None and fs_fields[0] == 'cgroup2':
+            mount = (fields[3], fields[4])
+        elif controller is not None and fs_fields[0] == 'cgroup' and key in fs_fields[2].split(','):
+            mount = (fields[3], fields[4])
+        if mount is not None:
+            break
+    if mount is None:
+        return []
+
+    root, mount_point = mount
+    rel = os.path.relpath(path, root)
+    if rel.startswith('..'):
+        # cgroup outside of what is mounted here (a namespace boundary), only the mount itself can be read
+        rel = '.'
+    dirs = []
+    while True:
+        d = os.path.normpath(os.path.join(mount_point, rel))
+        # a cgroup named from outside the namespace may not exist at this mount
+        if os.path.isdir(d):
+            dirs.append(d)
+        if rel in ('.', ''):
+            break
+        rel = os.path.dirname(rel) or '.'
+    return dirs
+
+def _memory_stat(d, key):
+    "entry `key` of the memory.stat of cgroup directory `d` [bytes], 0 if it is not there"
+    for line in (_read_first(os.path.join(d, 'memory.stat')) or '').splitlines():
+        name, _, value = line.partition(' ')
+        if name == key:
+            return int(value)
+    return 0
+
+def _cgroup_memory_limits():
+    # usage counts the page cache, the inactive file pages are reclaimed before the limit is hit
+    # v2
+    for d in _cgroup_dirs(None):
+        limit = _read_first(os.path.join(d, 'memory.max'))
+        if limit is not None and limit != 'max':
+            usage = int(_read_first(os.path.join(d, 'memory.current')) or 0)
+            yield int(limit), max(usage - _memory_stat(d, 'inactive_file'), 0)
+    # v1
+    for d in _cgroup_dirs('memory'):
+        limit = _read_first(os.path.join(d, 'memory.limit_in_bytes'))
+        # v1 reports "unlimited" as a huge number
+        if limit is not None and int(limit) < 2**60:
+            usage = int(_read_first(os.path.join(d, 'memory.usage_in_bytes')) or 0)
+            yield int(limit), max(usage - _memory_stat(d, 'total_inactive_file'), 0)
+
+def _cgroup_cpu_limits():
+    # v2
+    for d in _cgroup_dirs(None):
+        quota = _read_first(os.path.join(d, 'cpu.max'))
+        if quota is not None:
+            quota, _, period = quota.partition(' ')
+            if quota != 'max':
+                yield int(quota) / int(period or 100000)
+    # v1
+    for d in _cgroup_dirs('cpu'):
+        quota = _read_first(os.path.join(d, 'cpu.cfs_quota_us'))
+        period = _read_first(os.path.join(d, 'cpu.cfs_period_us'))
+        if quota is not None and period is not None and int(quota) > 0:
+            yield int(quota) / int(period)
+
+def pbs_cores():
+    "cores PBS allocated to this job on this node, None outside of a PBS job"
+    nodefile = os.environ.get('PBS_NODEFILE')
+    if nodefile:
+        try:
+            with open(nodefile) as f:
+                nodes = [line.strip() for line in f if line.strip()]
+        except (IOError, OSError):
+            nodes = []
+        # one line per allocated core, count those of this node
+        host = hostname().split('.')[0]
+        mine = [n for n in nodes if n.split('.')[0] == host]
+        if mine:
+            return len(mine)
+    for var in ('PBS_NUM_PPN', 'NCPUS'):
+        if os.environ.get(var):
+            return int(os.environ[var])
+    return None
+
+def cgroup_cores():
+    "cores allowed by the tightest cgroup cpu quota of this process, None if unlimited"
+    quotas = list(_cgroup_cpu_limits())
+    if not quotas:
+        return None
+    return max(int(min(quotas)), 1)
+
+def cgroup_memory():
+    """
+    memory left under the tightest cgroup memory limit of this process in MB, None if unlimited. Reclaimable page
+    cache counts as free.
+    """
+    room = [limit - usage for limit, usage in _cgroup_memory_limits()]
+    if not room:
+        return None
+    return int(max(min(room), 0) / (1024*1024))
+
+def available_cores():
+    "ids of the cores this process may run on (the cgroup cpuset), None where the OS does not say"
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return None
+
 def ncore():
-    return psutil.cpu_count(logical=False)
+    """
+    cores a job should use, the smallest of the physical cores, the cpuset, the cgroup cpu quota and the PBS
+    allocation
+    """
+    if os.environ.get(NCORE_ENV):
+        return int(os.environ[NCORE_ENV])
+    import psutil
+    limits = [psutil.cpu_count(logical=False), pbs_cores(), cgroup_cores()]
+    cores = available_cores()
+    if cores is not None:
+        limits.append(len(cores))
+    return max(min(n for n in limits if n), 1)
 
 def memory():
     "reasonable estimate of how much memory a job could use in MB"
-    return int(psutil.virtual_memory().available * 0.9 / (1024*1024))
+    if os.environ.get(MEMORY_ENV):
+        return int(os.environ[MEMORY_ENV])
+    import psutil
+    available = psutil.virtual_memory().available / (1024*1024)
+    cg_available = cgroup_memory()
+    if cg_available is not None:
+        available = min(available, cg_available)
+    return int(available * 0.9)
+
+def plan_jobs(njob, total_cores=None, total_memory=None):
+    """
+    Splits this node's allocation between `njob` concurrent jobs.
 
+    Returns one dict per job with its 'ncore', its 'memory' [MB], the ids of the 'cores' to pin it to (None where the
+    OS does not say) and the 'env' that makes :py:func:`ncore` and :py:func:`memory` report that share in the job.
+    Any cores and memory that do not divide evenly are left idle.
+    """
+    if total_cores is None:
+        total_cores = ncore()
+    if total_memory is None:
+        total_memory = memory()
+    if njob > total_cores:
+        raise ValueError("Can not run {} jobs at once on {} cores".format(njob, total_cores))
+    per_core = total_cores // njob
+    per_memory = int(total_memory // njob)
+    core_ids = available_cores()
+    plan = []
+    for i in range(njob):
+        cores = None
+        if core_ids is not None:
+            cores = core_ids[i * per_core:(i + 1) * per_core] or None
+        env = {NCORE_ENV: str(per_core), MEMORY_ENV: str(per_memory), 'OMP_NUM_THREADS': str(per_core)}
+        plan.append({'ncore': per_core, 'memory': per_memory, 'cores': cores, 'env': env})
+    return plan
@@ -1,43 +1,80 @@
+import logging
 import sys
 import re
 import os
+import mmap
 from pathlib import Path
 import subprocess as sp
 import numpy as np
 import traceback
 
 from . import cpu_info
+from . import array_io
+from . import raw_store
+from . import guess_cache
+from . import instrument
 
 
 from victor.constants import physconst
-from victor import util
+
+logger = logging.getLogger(__name__)
 
 # Collection helpers
-def _array_from_fchk(fchk_text, array_name):
-    matcher = re.compile(r'\A(?P<title>{})\s+R\s+N=\s+(?P<nele>\d+)\Z'.format(array_name))
-    fchk_lines = fchk_text.split('\n')
-    start_line = 0
-    nline = 0
-    found_match = False
-    for i, line in enumerate(fchk_lines):
-        match = matcher.match(line)
-        if match is not None:
-            found_match = True
-            start_line = i +1
-            nline = int(match.group('nele'))//5 + (1 * bool(int(match.group('nele'))%5))
-    if found_match:
-        data = np.array([float(x) for x in " ".join(fchk_lines[start_line:start_line+nline]).split()])
-        return data
-    else:
-        return None
+class FchkFile(object):
+    """
+    A formatted checkpoint file, memory mapped and indexed by section title in a single scan.
+
+    Array sections are only decoded (with numpy) when they are requested.
+    """
+    _header = re.compile(rb'^(?P<title>[A-Za-z][^\r\n]{0,39}?)[ \t]+(?P<type>[IRCHL])[ \t]+(?P<array>N=)?[ \t]*(?P<value>\S+)[ \t]*\r?$',
+                         re.MULTILINE)
+
+    def __init__(self, path):
+        with open(str(path), 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # title -> (type, count, start, end) for arrays or (type, None, value, None) for scalars
+        self.index = {}
+        # the first two lines are the job title and the route summary
+        start = self._data.find(b'\n', self._data.find(b'\n') + 1) + 1
+        last = None
+        for match in self._header.finditer(self._data, start):
+            if last is not None:
+                self.index[last[0]] = last[1:] + (match.start(), )
+                last = None
+            title = match.group('title').decode().strip()
+            dtype = match.group('type').decode()
+            if match.group('array'):
+                last = (title, dtype, int(match.group('value')), match.end() + 1)
+            else:
+                self.index[title] = (dtype, None, match.group('value').decode(), None)
+        if last is not None:
+            self.index[last[0]] = last[1:] + (len(self._data), )
+
+    def __contains__(self, title):
+        return title in self.index
+
+    def close(self):
+        self._data.close()
+
+    def get(self, title):
+        "The value of section `title` (an ndarray for array sections), None if it is not in the file"
+        if title not in self.index:
+            return None
+        dtype, count, start, end = self.index[title]
+        if count is None:
+            return int(start) if dtype == 'I' else (float(start) if dtype == 'R' else start)
+        if dtype in 'CH':
+            return self._data[start:end].decode()
+        text = self._data[start:end].decode('ascii')
+        return np.fromstring(text, dtype=int if dtype in 'IL' else float, sep=' ')[:count]
 
 def compute_rotation(w_au, rot_tensor, mw):
     hbar = physconst['h'] / (2*np.pi)
     prefactor = -72e6 * (hbar**2) * physconst['na'] / physconst['c']**2 / physconst['me']**2
     return prefactor * (w_au**2) * np.trace(rot_tensor) / mw / 3.0
 
-def collect_rotations(fchk_text, prog_options):
-    mw = np.sum(_array_from_fchk(fchk_text, array_name="Real atomic weights"))
+def collect_rotations(fchk, prog_options):
+    mw = np.sum(fchk.get("Real atomic weights"))
     rots = []
     if prog_options is not None:
         wls = prog_options.get('omega')
@@ -46,33 +83,29 @@ def collect_rotations(fchk_text, prog_options):
             if isinstance(wls[-1], str):
                 wls = wls[:-1]
             # better than doing one additional conversion just use the values in the fchk file
-            au_freqs = _array_from_fchk(fchk_text, array_name="Frequencies for FD properties")
+            au_freqs = fchk.get("Frequencies for FD properties")
             # sort wls in acend. order, then swap so they are in aced energy order (same as freqs from fchk)
             wls = list(sorted(wls))
             wls.reverse()
             if (au_freqs is not None) and len(au_freqs) == len(wls):
-                all_rot_tensors = _array_from_fchk(fchk_text, array_name="FD Optical Rotation Tensor").reshape(-1, 9)
+                all_rot_tensors = fchk.get("FD Optical Rotation Tensor").reshape(-1, 9)
                 for w_au, w_nm, rot_tensor in zip(au_freqs, wls, all_rot_tensors):
                     val = compute_rotation(w_au, rot_tensor.reshape(3,3), mw)
                     rots.append({'value': val, 'wavelength': w_nm, 'gauge': 'GIAO'})
     return rots
 
-def collect_hessian(fchk_text, natom):
-    hessian_data = _array_from_fchk(fchk_text, array_name="Cartesian Force Constants")
-    full_data = np.zeros((3*natom, 3*natom))
-    test_data = np.zeros((3*natom, 3*natom))
-    ut_index = np.triu_indices_from(full_data)
-    lt_index = np.tril_indices_from(full_data)
-    full_data[ut_index] = hessian_data
-    full_data[lt_index] = hessian_data
-    if np.allclose(test_data, full_data):
+def collect_hessian(fchk, natom):
+    hessian_data = fchk.get("Cartesian Force Constants")
+    if hessian_data is None or not np.any(hessian_data):
         return None
-    else:
-        return full_data
+    # stored as the lower triangle, row by row
+    full_data = np.zeros((3*natom, 3*natom))
+    full_data[np.tril_indices(3*natom)] = hessian_data
+    return full_data + np.tril(full_data, -1).T
 
-def collect_gradient(fchk_text):
-    grad_data = _array_from_fchk(fchk_text, array_name="Cartesian Gradient")
-    if np.allclose(grad_data, np.zeros_like(grad_data)):
+def collect_gradient(fchk):
+    grad_data = fchk.get("Cartesian Gradient")
+    if grad_data is None or not np.any(grad_data):
         return None
     else:
         return grad_data
@@ -82,14 +115,24 @@ def collect_gradient(fchk_text):
 def exe_g09():
     sp.run('g09 input.com output.log', check=True, shell=True, env=os.environ)
 
-def exe_fchk():
-    sp.run(['formchk','-3','vices.chk','vices.fchk'], env=os.environ)
+def exe_fchk(chk='vices'):
+    sp.run(['formchk','-3','{}.chk'.format(chk),'{}.fchk'.format(chk)], env=os.environ)
 
 # input helpers
+def _drivers(driver):
+    # a job may chain several drivers, run as linked steps
+    return list(driver) if isinstance(driver, (list, tuple)) else [driver]
+
+def _chk_name(step):
+    # every linked step writes its own checkpoint so the results of each can be collected
+    return "vices" if step == 0 else "vices{}".format(step)
+
 def _link_header(n):
     ret = []
-    ret.append("--Link{}--".format(n))
-    ret.append("%chk=vices")
+    ret.append("--Link{}--".format(min(n, 1)))
+    if n > 0:
+        ret.append("%oldchk={}".format(_chk_name(n - 1)))
+    ret.append("%chk={}".format(_chk_name(n)))
     ret.append("%mem={}mb".format(cpu_info.memory()))
     ret.append("%nproc={}".format(cpu_info.ncore()))
     return ret
@@ -121,7 +164,7 @@ def _rotation_wls(omegas):
 def _end_input():
     return ["\n","\n", "\n"]
 
-def _route(driver,input_json):
+def _route(driver,input_json, guess_read=False, chained=False):
     route_line = ["#P"]
     if  driver == 'gradient':
         route_line.append("Force")
@@ -131,6 +174,15 @@ def _route(driver,input_json):
         route_line.append("")
     route_line.append("{}/{}".format(input_json['modelchem'].get('method'), input_json['modelchem'].get('basis')))
     route_line.append("scf(conver=11) int=ultrafine")
+    if guess_read:
+        # orbitals of a nearby geometry from the checkpoint
+        route_line.append("guess=read")
+    if chained:
+        # same geometry and converged orbitals as the previous step
+        route_line.append("guess=read geom=check")
+    if driver in ('gradient', 'hessian'):
+        # keep derivatives in the input frame, the standard orientation differs between displaced geometries
+        route_line.append("nosymm")
     if driver == 'rotation':
         route_line.append('polar=OptRot')
         route_line.append('cphf(RdFreq,conver=11)')
@@ -139,19 +191,28 @@ def _route(driver,input_json):
     return [" ".join(route_line), '']
 
 
-def write_input(driver, input_json):
+def write_input(driver, input_json, guess_read=False):
     lines = []
-    lines.extend(_link_header(0))
-    lines.extend(_route(driver, input_json))
-    lines.extend(_title(driver, input_json['molecule'].get('name'), input_json['modelchem'].get('name')))
-    lines.extend(_geometry_sec(input_json))
-    if driver == 'rotation':
-        po = input_json.get('modelchem').get('program_options')
-        if po:
-            omegas = po.get('omega')
-            if omegas:
-                omegas = omegas[:-1]
-                lines.extend(_rotation_wls(omegas))
+    drivers = _drivers(driver)
+    for step, step_driver in enumerate(drivers):
+        lines.extend(_link_header(step))
+        lines.extend(_route(step_driver, input_json, guess_read and step == 0, step > 0))
+        lines.extend(_title(step_driver, input_json['molecule'].get('name'), input_json['modelchem'].get('name')))
+        if step == 0:
+            lines.extend(_geometry_sec(input_json))
+        else:
+            # geom=check still needs the charge and multiplicity
+            mol_json = input_json.get('molecule')
+            lines.extend(["{} {}".format(int(mol_json.get('charge')), mol_json.get('multiplicity')), ''])
+        if step_driver == 'rotation':
+            po = input_json.get('modelchem').get('program_options')
+            if po:
+                omegas = po.get('omega')
+                if omegas:
+                    omegas = omegas[:-1]
+                    lines.extend(_rotation_wls(omegas))
+        if step < len(drivers) - 1:
+            lines.append('')
     lines.extend(_end_input())
     infile_path = Path('input.com')
     infile_path.write_text("\n".join(lines))
@@ -165,37 +226,59 @@ def run(input_json):
     output_json['output'] = {}
 
     try:
+        # start from the equilibrium orbitals when they are available
+        guess_from = input_json.get('guess_from')
+        guess_read = guess_from is not None and guess_cache.fetch(guess_from, 'chk', 'vices.chk')
         # write the input file
-        write_input(calc_type, input_json)
+        with instrument.phase('write_input'):
+            write_input(calc_type, input_json, guess_read)
         # exe g09
-        exe_g09()
-        # exe fchk
-        exe_fchk()
-
-        # gather up stuff
-        fchk_path = Path('vices.fchk')
-        raw_out_text = Path('output.log').read_text()
-        hess = collect_hessian(fchk_path.read_text(), len(input_json['molecule']['symbols']))
-        grad = collect_gradient(fchk_path.read_text())
-        rotations = collect_rotations(fchk_path.read_text(), input_json['modelchem'].get('program_options'))
-
-        # store the raw output
-        output_json['raw_output']['log'] = raw_out_text
-        # the fchk file can be too large, mongo documents have a max size of 16mb so if the file is more than 12 we wont
-        # include it, just tell where the path is
-        if (fchk_path.stat().st_size // 1024**2) <= 12:
-            output_json['raw_output']['fchk'] = fchk_path.read_text()
-        else:
-            output_json['raw_output']['fchk_path'] = str(fchk_path.resolve())
+        with instrument.phase('g09'):
+            exe_g09()
+
+        # gather up stuff, merged over all linked steps
+        hess = None
+        grad = None
+        rotations = []
+        drivers = _drivers(calc_type)
+        for step, step_driver in enumerate(drivers):
+            chk = _chk_name(step)
+            # a chained step's checkpoint starts as a copy of the previous one, only take what this step computed
+            chained = len(drivers) > 1
+            # exe fchk
+            with instrument.phase('formchk'):
+                exe_fchk(chk)
+            fchk_path = Path('{}.fchk'.format(chk))
+            with instrument.phase('parse_fchk'):
+                fchk = FchkFile(fchk_path)
+                if hess is None and (not chained or step_driver == 'hessian'):
+                    hess = collect_hessian(fchk, len(input_json['molecule']['symbols']))
+                if grad is None and (not chained or step_driver in ('gradient', 'hessian')):
+                    grad = collect_gradient(fchk)
+                if not chained or step_driver == 'rotation':
+                    rotations.extend(collect_rotations(fchk, input_json['modelchem'].get('program_options')))
+                fchk.close()
+            # store the raw output, compressed in the raw store so the result document stays small whatever their size
+            with instrument.phase('store_raw'):
+                raw_key = 'fchk' if step == 0 else 'fchk{}'.format(step)
+                output_json['raw_output'][raw_key] = raw_store.store_file(fchk_path, job_dir='.')
+        with instrument.phase('store_raw'):
+            output_json['raw_output']['log'] = raw_store.store_file('output.log', job_dir='.')
         if hess is not None:
-            output_json['output']['hessian'] = util.pack_json_field(hess)
+            output_json['output']['hessian'] = array_io.pack_field(hess, 'hessian', symmetric=True)
         if grad is not None:
-            output_json['output']['gradient'] = util.pack_json_field(grad)
+            output_json['output']['gradient'] = array_io.pack_field(grad, 'gradient')
         if rotations:
             output_json['output']['rotations'] = rotations
         output_json['success'] = True
-        return output_json
     except Exception as e:
         output_json['success'] = False
         output_json['raw_output']['error'] = "\n".join(traceback.format_exception(*sys.exc_info()))
         return output_json
+    if guess_from is None and input_json.get('_id'):
+        # only a head start for the other jobs, the result stands without it
+        try:
+            guess_cache.save('vices.chk', input_json['_id'], 'chk')
+        except Exception:
+            logger.warning("could not save the guess checkpoint of %s", input_json['_id'], exc_info=True)
+    return output_json
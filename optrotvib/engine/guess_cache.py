@@ -0,0 +1,36 @@
+"""
+Shared cache of converged wavefunctions (g09 checkpoints, psi4 orbital files) used as the SCF guess of other jobs
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+# Root of the cache, by default a guess_cache directory in the job set (the parent of the job directory)
+GUESS_CACHE_ENV = 'ORV_GUESS_CACHE'
+
+def cache_dir(job_dir='.'):
+    root = os.environ.get(GUESS_CACHE_ENV)
+    if root:
+        return Path(root)
+    return Path(job_dir).resolve().parent / 'guess_cache'
+
+def _cache_path(key, ext, job_dir):
+    return cache_dir(job_dir) / "{}.{}".format(key, ext)
+
+def save(path, key, ext, job_dir='.'):
+    "Copies the wavefunction file `path` into the cache under `key`"
+    dest = _cache_path(key, ext, job_dir)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dest = dest.with_name("{}.{}.tmp".format(dest.name, os.getpid()))
+    shutil.copyfile(str(path), str(tmp_dest))
+    os.replace(str(tmp_dest), str(dest))
+    return dest
+
+def fetch(key, ext, dest, job_dir='.'):
+    "Copies the wavefunction cached under `key` to `dest`, returns False if there is none (yet)"
+    src = _cache_path(key, ext, job_dir)
+    if not src.exists():
+        return False
+    shutil.copyfile(str(src), str(dest))
+    return True
@@ -0,0 +1,129 @@
+"""
+Per phase timing and resource use of an engine run, recorded into the result's compute_info
+"""
+
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# Comma separated profilers to run along with a job: 'cprofile' (writes profile.pstats) and/or 'tracemalloc' (writes
+# tracemalloc.txt), the files go in the job directory
+PROFILE_ENV = 'ORV_PROFILE'
+TRACEMALLOC_TOP = 25
+
+def cpu_seconds():
+    "user + system time of this process and its finished child processes (g09, formchk)"
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def peak_rss():
+    "high water mark of the resident set size [MB] of this process or any finished child"
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # bytes on macOS, kB elsewhere
+    if sys.platform == 'darwin':
+        return rss / (1024 * 1024)
+    return rss / 1024
+
+class Recorder(object):
+    """
+    Wall and CPU time of named (possibly nested) phases, a phase entered more than once is summed.
+    """
+
+    def __init__(self, job_dir='.'):
+        self.job_dir = job_dir
+        self._phases = {}
+        self._stack = []
+        self._profilers = [p.strip().lower() for p in os.environ.get(PROFILE_ENV, '').split(',') if p.strip()]
+        self._profile = None
+        if 'cprofile' in self._profilers:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if 'tracemalloc' in self._profilers:
+            import tracemalloc
+            tracemalloc.start()
+        self._wall0 = time.perf_counter()
+        self._cpu0 = cpu_seconds()
+
+    @contextmanager
+    def phase(self, name):
+        self._stack.append(name)
+        key = "/".join(self._stack)
+        wall0 = time.perf_counter()
+        cpu0 = cpu_seconds()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            rec = self._phases.setdefault(key, {'name': key, 'walltime': 0.0, 'cputime': 0.0})
+            rec['walltime'] += time.perf_counter() - wall0
+            rec['cputime'] += cpu_seconds() - cpu0
+            # ru_maxrss only ever grows, this is the high water mark of the run up to the end of the phase, not the
+            # peak of the phase itself
+            rec['peak_rss'] = peak_rss()
+
+    def stop(self, ncpu=1):
+        """
+        Ends the recording (and any profiling), returns the total 'walltime' and 'cputime' [s], the average
+        'cpu_utilization' of `ncpu` cores, the 'peak_rss' [MB], the 'phases' and the 'profile' files written.
+
+        The utilization is capped at 1, CPU time is counted in clock ticks and can come out above the wall time of a
+        short run.
+        """
+        wall = time.perf_counter() - self._wall0
+        cpu = cpu_seconds() - self._cpu0
+        summary = {
+                'walltime': wall,
+                'cputime': cpu,
+                'cpu_utilization': min(cpu / (wall * max(ncpu, 1)), 1.0) if wall > 0 else 0.0,
+                'peak_rss': peak_rss(),
+                'phases': list(self._phases.values()),
+                }
+        profile_files = []
+        if self._profile is not None:
+            self._profile.disable()
+            path = os.path.join(str(self.job_dir), 'profile.pstats')
+            self._profile.dump_stats(path)
+            profile_files.append('profile.pstats')
+        if 'tracemalloc' in self._profilers:
+            import tracemalloc
+            _, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP]
+            tracemalloc.stop()
+            path = os.path.join(str(self.job_dir), 'tracemalloc.txt')
+            with open(path, 'w') as f:
+                f.write("peak traced memory: {:.1f} MB\n".format(peak / (1024 * 1024)))
+                f.write("\n".join(str(stat) for stat in top) + "\n")
+            summary['python_peak'] = peak / (1024 * 1024)
+            profile_files.append('tracemalloc.txt')
+        if profile_files:
+            summary['profile'] = profile_files
+        return summary
+
+# the recording of the job being run, if any
+_current = None
+
+def start(job_dir='.'):
+    "Starts recording a job run in `job_dir`, replacing any recording in progress"
+    global _current
+    _current = Recorder(job_dir)
+    return _current
+
+def stop(ncpu=1):
+    "Ends the current recording and returns its summary, None if nothing was being recorded"
+    global _current
+    recorder, _current = _current, None
+    if recorder is None:
+        return None
+    return recorder.stop(ncpu)
+
+@contextmanager
+def phase(name):
+    "Records the enclosed block as phase `name` of the current recording, does nothing if there is none"
+    if _current is None:
+        yield
+    else:
+        with _current.phase(name):
+            yield
@@ -1,3 +1,5 @@
+import json
+import logging
 import sys
 import os
 import traceback
@@ -5,8 +7,13 @@ import traceback
 from pathlib import Path
 
 from . import cpu_info
+from . import array_io
+from . import raw_store
+from . import guess_cache
+from . import instrument
 from victor.api import Molecule as vicMol
-from victor import util
+
+logger = logging.getLogger(__name__)
 
 def extract_rotations(all_vars_dict):
     rots_keys = [k for k in all_vars_dict.keys() if "SPECIFIC ROTATION" in k]
@@ -24,7 +31,42 @@ def extract_rotations(all_vars_dict):
     return rots
 
 
-def run(input_json):
+def _same_point_group(psi4, orbitals_path, psi_mol):
+    """
+    True if the orbitals saved in `orbitals_path` have the point group of `psi_mol`, psi4 can not project a guess
+    between point groups and a displacement along a mode that is not totally symmetric lowers the symmetry.
+    """
+    psi_mol.update_geometry()
+    saved = psi4.core.Wavefunction.from_file(orbitals_path)
+    return saved.molecule().schoenflies_symbol() == psi_mol.schoenflies_symbol()
+
+
+def _reference_method(psi4, method):
+    "The SCF `method` is built on, HF and DFT methods are their own reference"
+    energy_procedures = psi4.driver.procedures['energy']
+    if energy_procedures.get(method.lower()) is energy_procedures['scf']:
+        return method
+    return 'scf'
+
+
+def _save_guess(wfn, key, job_dir):
+    "Caches the orbitals of `wfn` as the guess of the other jobs, a failure only costs them their head start"
+    orbitals_path = Path(job_dir) / 'orbitals.npy'
+    try:
+        wfn.to_file(str(orbitals_path))
+        guess_cache.save(orbitals_path, key, 'npy', job_dir)
+    except Exception:
+        logger.warning("could not save the guess orbitals of %s", key, exc_info=True)
+    finally:
+        if orbitals_path.exists():
+            orbitals_path.unlink()
+
+
+def setup():
+    """
+    Imports psi4 and sets up everything shared by all jobs run in this process (scratch, memory, threads), returns
+    the psi4 module.
+    """
     # detect custom psi4, if we can
     psiapi_path = os.environ.get('PSIAPI_PATH')
     if psiapi_path:
@@ -32,6 +74,15 @@ def run(input_json):
 
     import psi4
 
+    # set some psi4 global stuff
+    # Scratch files
+    scr_path = os.environ.get("WORK")
+    psi4_io = psi4.core.IOManager.shared_object()
+    psi4_io.set_default_path(scr_path)
+    return psi4
+
+
+def _run_job(psi4, input_json, job_dir='.'):
     mol_json = input_json.pop('molecule')
     mc_json = input_json.pop('modelchem')
     output_json = {}
@@ -39,14 +90,8 @@ def run(input_json):
     output_json['success'] = False
     output_json['output'] = {}
 
-    # set some psi4 global stuff
-    # Scratch files
-    scr_path = os.environ.get("WORK")
-    psi4_io = psi4.core.IOManager.shared_object()
-    psi4_io.set_default_path(scr_path)
-
     # raw output file
-    outfile_path = Path('output.dat')
+    outfile_path = Path(job_dir) / 'output.dat'
     psi4.core.set_output_file(str(outfile_path), False)
 
     # node (or configured) memory and cores (after setting output file so the changes are registered there?)
@@ -62,34 +107,96 @@ def run(input_json):
         psi4.core.set_global_option(k, v)
 
     try:
-        # create the molecule
-        psi_mol = psi4.geometry(vicMol(mol_json, dtype='json').to_string())
         # extract name
         method = mc_json.get('method')
         driver = mc_json.get('driver')
-        if driver == 'gradient':
-            ret, wfn = psi4.gradient(method, return_wfn=True, molecule =psi_mol)
-        elif driver == 'hessian':
-            ret, wfn = psi4.hessian(method, return_wfn = True, molecule = psi_mol)
-        elif driver == 'rotation':
-            ret, wfn = psi4.properties(method, return_wfn = True, molecule = psi_mol, properties=['rotation'])
-        else:
-            raise RuntimeError("invalid driver {}: Validation should have caught this".format(driver))
-
-        grad = wfn.gradient()
-        hess = wfn.hessian()
-        rotations = extract_rotations(psi4.core.get_variables())
-        if hess:
-            output_json['output']['hessian'] = util.pack_json_field(hess.to_array())
-        if grad:
-            output_json['output']['gradient'] = util.pack_json_field(grad.to_array())
-        if rotations:
-            output_json['output']['rotations'] = rotations
-        output_json['output']['all_variables'] = psi4.core.get_variables()
+        # a list of drivers all run on the same SCF reference
+        drivers = list(driver) if isinstance(driver, (list, tuple)) else [driver]
+        # create the molecule, its string is no_com/no_reorient so derivatives stay in the input frame
+        psi_mol = psi4.geometry(vicMol(mol_json, dtype='json').to_string())
+        # start from the equilibrium orbitals when they are available, psi4 reads them from the scratch orbital file
+        guess_from = input_json.get('guess_from')
+        if guess_from is not None:
+            scratch_orbitals = os.path.join(psi4.core.IOManager.shared_object().get_default_path(),
+                                            psi4.core.get_writer_file_prefix(psi_mol.name()) + ".180.npy")
+            if guess_cache.fetch(guess_from, 'npy', scratch_orbitals, job_dir):
+                if _same_point_group(psi4, scratch_orbitals, psi_mol):
+                    psi4.core.set_global_option('guess', 'read')
+                else:
+                    os.remove(scratch_orbitals)
+        # converged once and handed to every driver, the wavefunction a driver returns need not hold orbitals (finite
+        # difference hessians)
+        with instrument.phase('scf'):
+            _, ref_wfn = psi4.energy(_reference_method(psi4, method), return_wfn=True, molecule=psi_mol)
+        grad = None
+        hess = None
+        for step_driver in drivers:
+            kwargs = {'return_wfn': True, 'molecule': psi_mol, 'ref_wfn': ref_wfn}
+            with instrument.phase(step_driver):
+                if step_driver == 'gradient':
+                    ret, wfn = psi4.gradient(method, **kwargs)
+                elif step_driver == 'hessian':
+                    ret, wfn = psi4.hessian(method, **kwargs)
+                elif step_driver == 'rotation':
+                    ret, wfn = psi4.properties(method, properties=['rotation'], **kwargs)
+                else:
+                    raise RuntimeError("invalid driver {}: Validation should have caught this".format(step_driver))
+            grad = wfn.gradient() or grad
+            hess = wfn.hessian() or hess
+
+        with instrument.phase('collect'):
+            rotations = extract_rotations(psi4.core.get_variables())
+            if hess:
+                output_json['output']['hessian'] = array_io.pack_field(hess.to_array(), 'hessian', symmetric=True,
+                                                                       directory=job_dir)
+            if grad:
+                output_json['output']['gradient'] = array_io.pack_field(grad.to_array(), 'gradient',
+                                                                        directory=job_dir)
+            if rotations:
+                output_json['output']['rotations'] = rotations
+            output_json['output']['all_variables'] = psi4.core.get_variables()
         output_json['success'] = True
-        output_json['raw_output']['outfile'] = outfile_path.read_text()
-        return output_json
+        with instrument.phase('store_raw'):
+            output_json['raw_output']['outfile'] = raw_store.store_file(outfile_path, job_dir=job_dir)
     except Exception as e:
         output_json['success'] = False
         output_json['raw_output']['error'] = "\n".join(traceback.format_exception(*sys.exc_info()))
         return output_json
+    if guess_from is None and input_json.get('_id'):
+        with instrument.phase('save_guess'):
+            _save_guess(ref_wfn, input_json['_id'], job_dir)
+    return output_json
+
+
+def run(input_json):
+    with instrument.phase('setup'):
+        psi4 = setup()
+    return _run_job(psi4, input_json)
+
+
+def run_many(job_dirs, finish):
+    """
+    Runs the jobs of several job directories one after the other in this process, psi4 is only imported and set up
+    once. Everything a job leaves behind (scratch files, options, variables) is cleared before the next one starts.
+
+    `finish(output_json, job_dir)` is called to write each job's result.
+    """
+    # the one time setup is recorded with the first job
+    instrument.start(job_dirs[0])
+    with instrument.phase('setup'):
+        psi4 = setup()
+    for i, job_dir in enumerate(job_dirs):
+        job_dir = Path(job_dir)
+        if i > 0:
+            instrument.start(job_dir)
+        with instrument.phase('read_input'):
+            input_json = json.loads(Path(job_dir / 'input.json').read_text())
+        r_id = input_json.get('_id')
+        with instrument.phase('clean'):
+            psi4.core.clean()
+            psi4.core.clean_options()
+            psi4.core.clean_variables()
+        with instrument.phase('engine'):
+            output_json = _run_job(psi4, input_json, job_dir)
+        output_json['_id'] = r_id
+        finish(output_json, job_dir)
@@ -0,0 +1,87 @@
+"""
+Content addressed, compressed and chunked storage of raw program output (logs, fchk files)
+"""
+
+import hashlib
+import os
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+
+# Root of the blob store, by default a raw_store directory in the job set (the parent of the job directory) so the jobs
+# of a job set share their chunks. Point it at a filesystem shared by all job sets to share them everywhere.
+RAW_STORE_ENV = 'ORV_RAW_STORE'
+CHUNK_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+def store_root(job_dir='.'):
+    root = os.environ.get(RAW_STORE_ENV)
+    if root:
+        return Path(root).resolve()
+    return Path(job_dir).resolve().parent / 'raw_store'
+
+def _blob_path(root, digest):
+    return Path(root) / digest[:2] / "{}.z".format(digest)
+
+def _write_blob(root, digest, data):
+    path = _blob_path(root, digest)
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+    tmp_path.write_bytes(zlib.compress(data, COMPRESS_LEVEL))
+    os.replace(str(tmp_path), str(path))
+
+def store_file(path, root=None, job_dir=None):
+    """
+    Stores the file at `path` as compressed chunks named by the sha256 of their contents, returns the ``raw_ref``
+    that goes in the result's raw_output in place of the file text.
+
+    The store is `root`, or that of the job in `job_dir` (by default the directory of `path`).
+    """
+    if root is None:
+        root = store_root(Path(path).resolve().parent if job_dir is None else job_dir)
+    root = Path(root)
+    chunks = []
+    whole = hashlib.sha256()
+    size = 0
+    with open(str(path), 'rb') as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest = hashlib.sha256(data).hexdigest()
+            _write_blob(root, digest, data)
+            chunks.append(digest)
+            whole.update(data)
+            size += len(data)
+    return {'store': str(root), 'encoding': 'zlib', 'chunks': chunks, 'size': size, 'sha256': whole.hexdigest()}
+
+def load_bytes(ref, root=None):
+    "The contents of a stored file, `root` overrides the store location recorded in `ref`"
+    root = Path(ref['store']) if root is None else Path(root)
+    data = b''.join(zlib.decompress(_blob_path(root, digest).read_bytes()) for digest in ref['chunks'])
+    if hashlib.sha256(data).hexdigest() != ref['sha256']:
+        raise ValueError("Raw output store: checksum mismatch for {}".format(ref['sha256']))
+    return data
+
+def load_text(ref, root=None):
+    return load_bytes(ref, root).decode()
+
+class RawOutput(Mapping):
+    """
+    Read-only view of a result's raw_output, stored files are only read and decompressed when looked up.
+    """
+
+    def __init__(self, raw_output, root=None):
+        self._raw = raw_output
+        self._root = root
+
+    def __getitem__(self, key):
+        value = self._raw[key]
+        if isinstance(value, dict):
+            return load_text(value, self._root)
+        return value
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
@@ -1,26 +1,107 @@
+import numpy as np
+
+from .constants import physconst
+
+# singular value cutoff used when building the rotation/translation space (psi4 default)
+LINEAR_A_TOL = 1.0E-2
+
+
 def wiberg_displacement_sizes(omegas, temp):
     c1 = 16.857
     c2 = 0.719384
     if temp < 0:
         raise ValueError("Temperature must be in Kelvin, therefore it can't be negative")
-    if temp > 0:
-        size_A0 = [np.sqrt((c1 / v) * (np.cosh(c2 * v / temp) / np.sinh(c2 * v / temp))) for v in omegas]
     if temp == 0:
         raise ValueError("Wiberg zero point displacement sizes have not been implemented yet")
-    return [x / physconst['bohr2angstroms'] for x in size_A0]
+    v = np.asarray(omegas, dtype=float)
+    size_A0 = np.sqrt((c1 / v) / np.tanh(c2 * v / temp))
+    return size_A0 / physconst['bohr2angstroms']
+
+
+def mean_square_amplitudes(omegas, mus, temp):
+    """Thermal mean square amplitude of each harmonic mode along its normalized un-mass-weighted mode vector.
+
+    Parameters
+    ----------
+    omegas : ndarray of float
+        (nmode,) frequencies [cm^-1]
+    mus : ndarray of float
+        (nmode,) reduced masses [u]
+    temp : float or ndarray of float
+        Temperature(s) [K], 0 gives the zero point amplitudes
+
+    Returns
+    -------
+    ndarray of float
+        (nmode,) <s^2> [a0^2], or (ntemp, nmode) for an array of temperatures
+    """
+    c1 = 16.857
+    c2 = 0.719384
+    temp = np.asarray(temp, dtype=float)
+    if np.any(temp < 0):
+        raise ValueError("Temperature must be in Kelvin, therefore it can't be negative")
+    v = np.asarray(omegas, dtype=float)
+    # at 0K c2 * v / temp -> inf and coth -> 1
+    with np.errstate(divide='ignore'):
+        coth = 1.0 / np.tanh(c2 * v / temp[..., None])
+    return (c1 / (np.asarray(mus, dtype=float) * v)) * coth / physconst['bohr2angstroms']**2
 
 
 def mort_displacment_sizes(S, avg_disp_per_atom=0.04):
     three_n, nmode = S.shape
-    natom = three_n / 3
-    d = 0.0
-    for m in range(nmode):
-        for n in range(natom):
-            atom_sum = S[n, m]**2 + S[n + 1, m]**2 + S[n + 2, m]**2
-            d += np.sqrt(atom_sum)
+    natom = three_n // 3
+    # sum over modes and atoms of the length of each atom's displacement
+    d = np.sum(np.linalg.norm(S.reshape(natom, 3, nmode), axis=1))
 
     delta = avg_disp_per_atom * (nmode * natom) / (np.sqrt(3) * d)
-    return [delta] * nmode
+    return np.full(nmode, delta)
+
+
+def displaced_geometries(geom, x, step_sizes):
+    """All of the +/- displaced geometries along a set of normal modes, as one array.
+
+    Parameters
+    ----------
+    geom : ndarray of float
+        (natom, 3) equilibrium geometry [a0]
+    x : ndarray of float
+        (3*natom, nmode) normalized un-mass-weighted normal modes (``vibinfo['x']``)
+    step_sizes : ndarray of float
+        (nmode,) size of the step taken along each mode [a0]
+
+    Returns
+    -------
+    ndarray of float
+        (nmode, 2, natom, 3) displaced geometries, ``[:, 0]`` is the + and ``[:, 1]`` the - displacement
+    """
+    geom = np.asarray(geom, dtype=float)
+    natom = geom.shape[0]
+    disp = (np.asarray(x).T * np.asarray(step_sizes, dtype=float)[:, None]).reshape(-1, 1, natom, 3)
+    return geom[None, None] + np.array([1.0, -1.0])[None, :, None, None] * disp
+
+
+def hessian_from_gradients(gradients, step_sizes):
+    """Assembles a Hessian from central differences of gradients at +/- displaced Cartesian geometries.
+
+    Parameters
+    ----------
+    gradients : ndarray of float
+        (3*natom, 2, 3*natom) gradients [Eh/a0], ``[k, 0]`` at the + and ``[k, 1]`` at the - displacement of
+        Cartesian coordinate k
+    step_sizes : float or ndarray of float
+        size of the step taken along each coordinate [a0]
+
+    Returns
+    -------
+    ndarray of float
+        (3*natom, 3*natom) symmetrized Hessian [Eh/a0/a0]
+    """
+    gradients = np.asarray(gradients, dtype=float)
+    ncoord = gradients.shape[0]
+    gradients = gradients.reshape(ncoord, 2, ncoord)
+    steps = np.broadcast_to(np.asarray(step_sizes, dtype=float), (ncoord, ))
+    hess = (gradients[:, 0] - gradients[:, 1]) / (2.0 * steps[:, None])
+    return 0.5 * (hess + hess.T)
 
 
 def _get_TR_space(m, geom, space='TR', tol=LINEAR_A_TOL, verbose=False):
@@ -121,7 +202,32 @@ def _phase_cols_to_max_element(arr, tol=LINEAR_A_TOL, verbose=False):
     return arr2
 
 
-def get_vibinfo(hess, geom, mass):
+def _project_TR(mwhess, TRspace):
+    """Project the (possibly stacked) translation/rotation vectors `TRspace` (..., nrt, 3*natom) out of `mwhess`.
+
+    Equivalent to ``P.T @ mwhess @ P`` with ``P = 1 - TRspace.T @ TRspace`` but applied as a rank-nrt update, so
+    the dense projector is never formed and the cost is O(natom^2) rather than O(natom^3).
+    """
+    TRt = np.swapaxes(TRspace, -1, -2)
+    HT = mwhess @ TRt
+    THT = TRspace @ HT
+    return mwhess - HT @ TRspace - TRt @ np.swapaxes(HT, -1, -2) + TRt @ THT @ TRspace
+
+
+def _partial_eigh(mat, lo, hi):
+    """Eigenpairs `lo` through `hi - 1` (ascending order) of the symmetric matrix `mat`.
+
+    Uses the subset driver of scipy when it is available, otherwise falls back to a full numpy diagonalization.
+    """
+    try:
+        import scipy.linalg
+    except ImportError:
+        evals, evecs = np.linalg.eigh(mat)
+        return evals[lo:hi], evecs[:, lo:hi]
+    return scipy.linalg.eigh(mat, subset_by_index=[lo, hi - 1])
+
+
+def get_vibinfo(hess, geom, mass, modes=None):
     """Computes the vibinfo for this mass/geom/hess combo
 
     Parameters
@@ -132,6 +238,10 @@ def get_vibinfo(hess, geom, mass):
         (natom, 3) geometry in [a0] at which the hessian was computed
     mass : ndarray of float
         (natom,) atomic masses [u].
+    modes : int or (int, int), optional
+        Only solve for the lowest `modes` vibrational modes, or for the vibrational modes in the half open index range
+        given (ascending frequency order). The default computes all of them. Selecting a few modes of a large molecule
+        uses a partial eigensolver (scipy) instead of the full diagonalization.
 
     Returns
     -------
@@ -164,50 +274,53 @@ def get_vibinfo(hess, geom, mass):
             """Dimension mismatch amoung mass ({}), geometry ({}) and Hessian ({})""".format(
                 mass.shape, geom.shape, hess.shape))
 
-    mw = sum(mass)
-    com = np.array([0.0, 0.0, 0.0])
-    for i, m in enumerate(mass):
-        com[0] += (geom[i, 0] * mass[i]) / mw
-        com[1] += (geom[i, 1] * mass[i]) / mw
-        com[2] += (geom[i, 2] * mass[i]) / mw
-    if sum(com) > 1.0e-10:
+    com = np.dot(mass, geom) / np.sum(mass)
+    if np.any(np.abs(com) > 1.0e-10):
         raise ValueError("Error, molecule must be at the center of mass")
 
-    natom = len(mass)
-
     # get idealized rotations/translations
     TRspace = _get_TR_space(mass, geom, space='TR', tol=LINEAR_A_TOL)
     nrt = TRspace.shape[0]
 
-    # form rot/tran projector
-    P = np.identity(3 * natom)
-    for irt in TRspace:
-        P -= np.outer(irt, irt)
-
     # form mass weighting matrix
     sqrtmmm = np.repeat(np.sqrt(mass), 3)
     sqrtmmminv = np.divide(1.0, sqrtmmm)
 
     # mass weight the hessian
-    nmwhess = hess.copy()
-    mwhess = np.einsum('i,ij,j->ij', sqrtmmminv, nmwhess, sqrtmmminv)
+    mwhess = hess * sqrtmmminv[:, None] * sqrtmmminv[None, :]
 
     # project out translation/rotation
-    mwhess_proj = np.dot(P.T, mwhess).dot(P)
+    mwhess_proj = _project_TR(mwhess, TRspace)
 
-    force_constant_au, qL = np.linalg.eigh(mwhess_proj)
-    idx = np.argsort(force_constant_au)
-    #idx = idx[:(3*natom]
-    # sort
-    force_constant_au = force_constant_au[idx]
-    qL = qL[:, idx]
-    # remove zeros
-    idx = [i for i, v in enumerate(force_constant_au) if np.abs(v) > 1.0e-5]
-    force_constant_au = force_constant_au[idx]
-    qL = qL[:, idx]
+    if modes is None:
+        force_constant_au, qL = np.linalg.eigh(mwhess_proj)
+    else:
+        if isinstance(modes, int):
+            modes = (0, modes)
+        # the (up to nrt) zero eigenvalues of the TR space can fall anywhere among the lowest roots
+        force_constant_au, qL = _partial_eigh(mwhess_proj, 0, min(modes[1] + nrt, mwhess_proj.shape[0]))
+
+    # remove zeros (eigh returns the eigenvalues in ascending order)
+    keep = np.abs(force_constant_au) > 1.0e-5
+    force_constant_au = force_constant_au[keep]
+    qL = qL[:, keep]
+    if modes is not None:
+        force_constant_au = force_constant_au[modes[0]:modes[1]]
+        qL = qL[:, modes[0]:modes[1]]
     #qL = _phase_cols_to_max_element(qL)
 
-    # populate vibinfo
+    vibinfo.update(_populate_vibinfo(force_constant_au, qL, sqrtmmminv))
+
+    return vibinfo
+
+
+def _populate_vibinfo(force_constant_au, qL, sqrtmmminv):
+    """Build the vibinfo fields from the (possibly stacked) projected eigenpairs.
+
+    The mode index is always the last axis of `qL`, so the same conversions serve
+    both :py:func:`get_vibinfo` and :py:func:`get_vibinfo_batch`.
+    """
+    vibinfo = {}
     vibinfo['f'] = force_constant_au
     uconv_km = physconst['hartree2J'] / (physconst['bohr2m'] * physconst['bohr2m'] * physconst['amu2kg'])
     uconv_cm = 1.0 / (2.0 * np.pi * physconst['c'] * 100.00)
@@ -217,13 +330,125 @@ def get_vibinfo(hess, geom, mass):
     vibinfo['omega'] = freq_cm_1
 
     vibinfo['q'] = qL
-    wL = np.einsum('i,ij->ij', sqrtmmminv, qL)
+    wL = sqrtmmminv[..., :, None] * qL
     vibinfo['w'] = wL
 
-    reduced_mass = np.divide(1.0, np.linalg.norm(wL, axis=0)**2)
+    reduced_mass = np.divide(1.0, np.linalg.norm(wL, axis=-2)**2)
     vibinfo['mu'] = reduced_mass
 
-    xL = np.sqrt(reduced_mass) * wL
+    xL = np.sqrt(reduced_mass)[..., None, :] * wL
     vibinfo['x'] = xL
 
     return vibinfo
+
+
+def _get_TR_space_batch(mass, geom, tol=LINEAR_A_TOL):
+    """Stacked version of :py:func:`_get_TR_space`.
+
+    Parameters
+    ----------
+    mass: array (nbatch, natom)
+        The masses of each atom for each batch member
+    geom: array (nbatch, natom, 3)
+        The positions of each atom for each batch member
+    tol: tolerance (to handle noisy linear geometries)
+
+    Returns
+    -------
+    ndarray (nbatch, 6, 3*natom)
+        Orthonormal translation/rotation vectors. Rows that are not independent (linear molecules) are zero so the
+        result can be stacked regardless of the number of independent vectors.
+    """
+    nbatch, natom = mass.shape
+    sqrtm = np.sqrt(mass)[:, :, None]
+    TRspace = np.zeros((nbatch, 6, natom, 3))
+    for k in range(3):
+        unit = np.zeros(3)
+        unit[k] = 1.0
+        TRspace[:, k, :, k] = sqrtm[:, :, 0]
+        TRspace[:, 3 + k] = sqrtm * np.cross(unit, geom)
+    TRspace = TRspace.reshape(nbatch, 6, 3 * natom)
+
+    u, s, vh = np.linalg.svd(np.swapaxes(TRspace, -1, -2), full_matrices=False)
+    if not tol:
+        eps = np.finfo(float).eps
+        tol = (3 * natom * np.amax(s, axis=-1) * eps)[:, None]
+    Q = u * (s > tol)[:, None, :]
+    return np.swapaxes(Q, -1, -2)
+
+
+def get_vibinfo_batch(hess, geom, mass):
+    """Computes the vibinfo for a stack of mass/geom/hess combos at once.
+
+    Any of the inputs may be given for a single system or stacked along a leading batch axis, inputs without a batch
+    axis are shared by every member of the batch. The typical uses are one Hessian with many isotopologue mass sets
+    or many Hessians of the same molecule. The Cartesian Hessian is never copied or re-read for each mass set, only
+    the mass weighting and projection are done per batch member.
+
+    Parameters
+    ----------
+    hess : ndarray of float
+        (3*natom, 3*natom) or (nbatch, 3*natom, 3*natom) non-mass-weighted hessian in atomic units [Eh/a0/a0]
+    geom : ndarray of float
+        (natom, 3) or (nbatch, natom, 3) geometry in [a0] at which the hessian was computed
+    mass : ndarray of float
+        (natom,) or (nbatch, natom) atomic masses [u].
+
+    Returns
+    -------
+    dict
+        Same keys as :py:func:`get_vibinfo` with a leading (nbatch,) axis on each array.
+
+    Notes
+    -----
+    Changing the masses moves the center of mass, so each geometry is translated to the center of mass of its own
+    mass set before the rotations are built. All members of the batch must have the same number of non-zero modes,
+    use :py:func:`get_vibinfo` on each system if they do not.
+    """
+    hess = np.asarray(hess, dtype=float)
+    geom = np.asarray(geom, dtype=float)
+    mass = np.asarray(mass, dtype=float)
+    if hess.ndim == 2:
+        hess = hess[None]
+    if geom.ndim == 2:
+        geom = geom[None]
+    if mass.ndim == 1:
+        mass = mass[None]
+
+    natom = mass.shape[-1]
+    if not ((geom.shape[-2] == natom) and (geom.shape[-1] == 3) and (hess.shape[-2:] == (3 * natom, 3 * natom))):
+        raise AttributeError(
+            """Dimension mismatch amoung mass ({}), geometry ({}) and Hessian ({})""".format(
+                mass.shape, geom.shape, hess.shape))
+    try:
+        nbatch = np.broadcast_shapes(hess.shape[:1], geom.shape[:1], mass.shape[:1])[0]
+    except ValueError:
+        raise AttributeError(
+            """Batch size mismatch amoung mass ({}), geometry ({}) and Hessian ({})""".format(
+                mass.shape, geom.shape, hess.shape))
+
+    mass = np.broadcast_to(mass, (nbatch, natom))
+    geom = np.broadcast_to(geom, (nbatch, natom, 3))
+
+    # each mass set has its own center of mass
+    com = np.einsum('bi,bix->bx', mass, geom) / mass.sum(axis=1)[:, None]
+    geom = geom - com[:, None, :]
+
+    # get idealized rotations/translations, and project them out of the mass weighted hessian
+    TRspace = _get_TR_space_batch(mass, geom, tol=LINEAR_A_TOL)
+
+    sqrtmmminv = 1.0 / np.repeat(np.sqrt(mass), 3, axis=1)
+    mwhess = hess * sqrtmmminv[:, :, None] * sqrtmmminv[:, None, :]
+    mwhess_proj = _project_TR(mwhess, TRspace)
+
+    # eigh returns ascending eigenvalues, so only the zeros need removing
+    force_constant_au, qL = np.linalg.eigh(mwhess_proj)
+    keep = np.abs(force_constant_au) > 1.0e-5
+    nvib = keep.sum(axis=1)
+    if np.any(nvib != nvib[0]):
+        raise ValueError("Error, batch members have different numbers of vibrational modes {}".format(nvib.tolist()))
+    idx = np.argsort(~keep, axis=1, kind='stable')[:, :nvib[0]]
+    force_constant_au = np.take_along_axis(force_constant_au, idx, axis=1)
+    qL = np.take_along_axis(qL, idx[:, None, :], axis=2)
+
+    return _populate_vibinfo(force_constant_au, qL, sqrtmmminv)
@@ -1,4 +1,8 @@
+import copy
+from pathlib import Path
 
+from . import vibcorr
+from .result_cache import result_key
 
 
 def _make_job_json(molecule, job_spec, name):
@@ -6,19 +10,65 @@ def _make_job_json(molecule, job_spec, name):
     job_json['name'] = name
     job_json['modelchem'] = job_spec
     job_json['molecule'] = molecule.to_json()
+    job_json['_id'] = result_key(job_json['molecule'], job_spec)
     return job_json
 
 
-def generate_jobs_for_stencil(stencil, job_spec, name):
-    """make a directory for a job set, and create job jsons for each mode"""
+def generate_jobs_for_stencil(stencil, job_spec, name, result_cache=None, include_eq=True):
+    """make a directory for a job set, and create job jsons for each mode
+
+    `stencil` is a :py:class:`optrotvib.stencil.Stencil` (or a dict with the same 'eq_molecule' and 'modes' keys),
+    displaced Molecules are only built one at a time as each job json is made.
+
+    The equilibrium job "eq" can be left out with `include_eq` when its result is not needed (central differences
+    of gradients). The first job is the SCF guess source of all the others.
+
+    With a :py:class:`optrotvib.result_cache.ResultCache`, jobs that already have a successful result are not
+    returned, their directory in the job set is linked to the existing one instead.
+    """
 
     job_set_dir = Path() / name
     if job_set_dir.exists():
         return False
     job_set_dir.mkdir(parents=True)
     jobs = []
-    jobs.append(_make_job_json(stencil['eq_molecule'], job_spec, "eq"))
+    if include_eq:
+        jobs.append(_make_job_json(stencil['eq_molecule'], job_spec, "eq"))
     for mode_nm, mode_mol in stencil['modes'].items():
         jobs.append(_make_job_json(mode_mol, job_spec, mode_nm))
 
+    # the other jobs start their SCF from the orbitals of the first (the equilibrium, if there is one)
+    for job in jobs[1:]:
+        job['guess_from'] = jobs[0]['_id']
+
+    if result_cache is not None:
+        todo = []
+        for job in jobs:
+            done_dir = result_cache.lookup(job['_id'])
+            if done_dir is None:
+                todo.append(job)
+            else:
+                Path(job_set_dir / job['name']).symlink_to(done_dir, target_is_directory=True)
+        jobs = todo
+
     return job_set_dir, jobs
+
+
+def generate_screened_jobs(stencil, screen_job_set_dir, job_spec, name, threshold=0.95, temp=0.0, result_cache=None):
+    """make the job set for the target model chemistry `job_spec` for only the modes that matter
+
+    The modes are ranked by the correction computed from the (completed) job set `screen_job_set_dir`, normally the
+    same stencil run with a cheap method/basis, and every mode not needed to reach `threshold` of the correction is
+    screened out of a copy of `stencil` before the jobs are made. `stencil` itself is left as it is.
+
+    Returns False if the job set already exists, otherwise the job set directory, the jobs and the screened stencil
+    (to evaluate the new job set with).
+    """
+
+    if (Path() / name).exists():
+        return False
+    screen = vibcorr.stencil_correction(stencil, screen_job_set_dir, temp)
+    screened = copy.copy(stencil)
+    screened.screen(vibcorr.select_modes(screen['mode'], threshold))
+    job_set_dir, jobs = generate_jobs_for_stencil(screened, job_spec, name, result_cache)
+    return job_set_dir, jobs, screened
@@ -0,0 +1,63 @@
+"""
+Hessians assembled from finite differences of distributed gradient jobs
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from . import findif
+from .engine.array_io import unpack_field
+from .stencil import Stencil, parse_mode_name
+from .vibcorr import load_result
+
+
+def gradient_job_spec(job_spec):
+    """
+    The modelchem of the displaced gradient jobs for a Hessian at `job_spec`.
+    """
+    spec = dict(job_spec)
+    spec['driver'] = 'gradient'
+    return spec
+
+
+def gradient_stencil(eq_molecule, step=0.005, use_symmetry=True):
+    """
+    The 6N (less any symmetry images) displaced geometries needed for a Hessian of `eq_molecule`.
+
+    Make the jobs with ``generate.generate_jobs_for_stencil(stencil, gradient_job_spec(job_spec), name,
+    include_eq=False)``, the central differences do not use the gradient at the equilibrium. Every job is independent
+    so they can be spread over as many nodes as are available.
+    """
+    return Stencil.cartesian(eq_molecule, step=step, use_symmetry=use_symmetry)
+
+
+def load_stencil_gradients(stencil, job_set_dir):
+    """
+    Loads the gradients of the displaced geometries of a Cartesian `stencil` from the job directories in
+    `job_set_dir`, filling in symmetry images.
+
+    Returns
+    -------
+    ndarray of float
+        (3*natom, 2, natom, 3) gradients
+    """
+    job_set_dir = Path(job_set_dir)
+    natom = stencil.eq_molecule.geometry.shape[0]
+    grads = np.full((stencil.nmode, 2, natom, 3), np.nan)
+    for name in stencil.mode_names():
+        result = load_result(job_set_dir / name)
+        if result is None or 'gradient' not in result['output']:
+            raise ValueError("Hessian: no gradient found for displacement '%s' in %s" % (name, job_set_dir))
+        imode, isign = parse_mode_name(name)
+        grads[imode, isign] = unpack_field(result['output']['gradient'], job_set_dir / name).reshape(natom, 3)
+    return stencil.fill_vector_images(grads)
+
+
+def assemble_hessian(stencil, job_set_dir):
+    """
+    The symmetrized Cartesian Hessian [Eh/a0/a0] from the gradient jobs of a Cartesian `stencil`, ready for
+    :py:func:`optrotvib.findif.get_vibinfo`.
+    """
+    grads = load_stencil_gradients(stencil, job_set_dir)
+    return findif.hessian_from_gradients(grads.reshape(stencil.nmode, 2, -1), stencil.step_sizes)
@@ -0,0 +1,169 @@
+"""
+Run engine jobs in a local pool of processes, a drop-in for the PBS submission in submit.py
+"""
+
+import itertools
+import json
+import os
+import resource
+import shlex
+import shutil
+import subprocess as sp
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .engine import cpu_info
+from .submit import array_element_id
+
+ENGINE_COMMAND = [sys.executable, '-m', 'optrotvib.engine.cli']
+# fraction of memory_per_job the engine is told it may use, as with cpu_info.memory
+MEMORY_FRACTION = 0.9
+# address space allowed on top of memory_per_job for the interpreter, shared libraries and thread stacks [MB]
+ADDRESS_SPACE_OVERHEAD = 1024
+
+
+class LocalExecutor(object):
+    """
+    Runs jobs on this machine, `cores_per_job` cores and (optionally) `memory_per_job` MB each, with as many at once
+    as the cores allow.
+
+    The node is split between the slots with :py:func:`optrotvib.engine.cpu_info.plan_jobs`, each running job is pinned
+    to its own set of cores (where the OS supports it) and is told its share of the node through cpu_info, so jobs
+    never compete for cores or memory. Job states use the PBS letters: 'Q' queued, 'R' running and
+    'C' complete.
+
+    With `memory_per_job` the engine is given MEMORY_FRACTION of it to work with, and the address space of the job
+    is capped at `memory_per_job` + ADDRESS_SPACE_OVERHEAD MB as a backstop against runaway jobs. Pinning and the cap
+    are applied by ``taskset``/``prlimit`` wrapped around the job command, so the shell running `compute_env` and
+    everything it starts are covered from the beginning.
+    """
+
+    def __init__(self, cores_per_job=1, memory_per_job=None, total_cores=None):
+        if total_cores is None:
+            total_cores = cpu_info.ncore()
+        self.cores_per_job = cores_per_job
+        self.memory_per_job = memory_per_job
+        nslot = max(total_cores // cores_per_job, 1)
+        total_memory = None if memory_per_job is None else memory_per_job * nslot
+        # each slot owns a fixed block of cores
+        self._plan = cpu_info.plan_jobs(nslot, nslot * cores_per_job, total_memory)
+        if memory_per_job is not None:
+            for share in self._plan:
+                share['env'][cpu_info.MEMORY_ENV] = str(int(memory_per_job * MEMORY_FRACTION))
+        self._free_slots = list(range(nslot))
+        self._slot_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=nslot)
+        self._ids = itertools.count()
+        self._states = {}
+        self._futures = {}
+
+    def _address_space_limit(self):
+        if self.memory_per_job is None:
+            return None
+        return (self.memory_per_job + ADDRESS_SPACE_OVERHEAD) * 1024 * 1024
+
+    def _limit_prefix(self, cores):
+        "taskset/prlimit command prefix applying the slot's limits, None if the tools are not available"
+        prefix = []
+        if cores is not None:
+            if shutil.which('taskset') is None:
+                return None
+            prefix += ['taskset', '-c', ",".join(str(c) for c in sorted(cores))]
+        limit = self._address_space_limit()
+        if limit is not None:
+            if shutil.which('prlimit') is None:
+                return None
+            prefix += ['prlimit', '--as={}'.format(limit), '--']
+        return prefix
+
+    def _run(self, jid, job_path, compute_env):
+        with self._slot_lock:
+            slot = self._free_slots.pop()
+        self._states[jid] = 'R'
+        try:
+            env = dict(os.environ)
+            env.update(self._plan[slot]['env'])
+            if compute_env:
+                # same environment setup lines as would go in the pbs script
+                cmd = ['/bin/sh', '-c', "\n".join(list(compute_env) + [" ".join(shlex.quote(a) for a in ENGINE_COMMAND)])]
+            else:
+                cmd = list(ENGINE_COMMAND)
+            cores = self._plan[slot]['cores']
+            prefix = self._limit_prefix(cores)
+            proc = sp.Popen((prefix or []) + cmd, cwd=str(job_path), env=env)
+            if prefix is None:
+                # no taskset/prlimit, limit the child right after it starts (preexec_fn is not safe with threads)
+                if cores is not None:
+                    os.sched_setaffinity(proc.pid, cores)
+                limit = self._address_space_limit()
+                if limit is not None and hasattr(resource, 'prlimit'):
+                    resource.prlimit(proc.pid, resource.RLIMIT_AS, (limit, limit))
+            proc.wait()
+            return proc.returncode
+        finally:
+            self._states[jid] = 'C'
+            with self._slot_lock:
+                self._free_slots.append(slot)
+
+    def _queue(self, jid, job_path, compute_env):
+        self._states[jid] = 'Q'
+        self._futures[jid] = self._pool.submit(self._run, jid, job_path, compute_env)
+        Path(job_path / 'job.id').write_text(jid)
+        return jid
+
+    def submit_dir(self, job_path, compute_env=None):
+        """Queues the job in `job_path` (which must hold an input.json), returns the job id"""
+        return self._queue("local-{}".format(next(self._ids)), Path(job_path), compute_env)
+
+    def submit(self, compute_env, qsub_args, compute_dir, job):
+        """Same contract as :py:func:`optrotvib.submit.submit`, `qsub_args` are ignored"""
+        job_path = Path(compute_dir) / job['name']
+        if not job_path.exists():
+            job_path.mkdir(parents=True)
+        Path(job_path / 'input.json').write_text(json.dumps(job))
+        return self.submit_dir(job_path, compute_env)
+
+    def submit_array(self, compute_env, qsub_args, job_set_dir, jobs):
+        """
+        Same contract as :py:func:`optrotvib.submit.submit_array`, `qsub_args` are ignored. Returns the array id
+        (None if there are no `jobs`), the elements are queued as separate jobs with the ids of array elements.
+        """
+        if not jobs:
+            return None
+        job_set_dir = Path(job_set_dir)
+        array_jid = "local-{}[]".format(next(self._ids))
+        for i, job in enumerate(jobs):
+            job_path = job_set_dir / job['name']
+            if not job_path.exists():
+                job_path.mkdir(parents=True)
+            Path(job_path / 'input.json').write_text(json.dumps(job))
+            self._queue(array_element_id(array_jid, i), job_path, compute_env)
+        Path(job_set_dir / 'array.id').write_text(array_jid)
+        return array_jid
+
+    def check_by_id(self, jid):
+        # unknown jobs are assumed to have completed, as with qstat
+        return self._states.get(jid, 'C')
+
+    def check_by_dir(self, job_dir):
+        jid = Path(Path(job_dir) / 'job.id').read_text()
+        return self.check_by_id(jid)
+
+    def check_many_by_id(self, jids):
+        return {jid: self.check_by_id(jid) for jid in jids}
+
+    def check_many_by_dir(self, job_dirs):
+        return {job_dir: self.check_by_dir(job_dir) for job_dir in job_dirs}
+
+    def check_array(self, array_jid, njob):
+        "{array index: state} for the `njob` elements of the array job `array_jid`"
+        return {i: self.check_by_id(array_element_id(array_jid, i)) for i in range(njob)}
+
+    def wait(self):
+        """Blocks until every submitted job has finished, returns {job id: exit code}"""
+        return {jid: fut.result() for jid, fut in self._futures.items()}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
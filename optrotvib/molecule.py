@@ -5,6 +5,7 @@ DQM Molecule object and helpers
 import numpy as np
 import re
 import os
+import copy
 import json
 
 from . import constants
@@ -15,6 +16,21 @@ GEOMETRY_NOISE = 7
 MASS_NOISE = 6
 CHARGE_NOISE = 4
 
+# Distance [a0] within which a symmetry operation must map an atom onto an equivalent one
+SYMMETRY_TOL = 1.0e-2
+
+# The operations of D2h with all elements along the Cartesian axes, as the diagonal of their matrix
+_D2H_OPERATIONS = [
+    ("E", (1, 1, 1)),
+    ("C2(z)", (-1, -1, 1)),
+    ("C2(y)", (-1, 1, -1)),
+    ("C2(x)", (1, -1, -1)),
+    ("i", (-1, -1, -1)),
+    ("sigma(xy)", (1, 1, -1)),
+    ("sigma(xz)", (1, -1, 1)),
+    ("sigma(yz)", (-1, 1, 1)),
+]
+
 class Molecule(object):
     """
     This is a Mongo QCDB molecule class.
@@ -25,6 +41,9 @@ class Molecule(object):
         The software-side rep of a Molecule document
         """
 
+        # Cached JSON form and hash, any change to the molecule clears these (see __setattr__)
+        self._cache = {}
+
         # Layout all known attributes
         self._symbols = []
         self._geometry = None
@@ -42,6 +61,8 @@ class Molecule(object):
 
         # List any flags
         self._custom_masses = False
+        # Built internally from an already validated molecule, skip schema validation of the JSON form
+        self._trusted = False
         self.fix_com = True
         self.fix_orientation = True
 
@@ -74,6 +95,16 @@ class Molecule(object):
 
 ### Any needed setters and getters
 
+    def __setattr__(self, name, value):
+        # Setting any attribute (geometry, symbols, masses, charges, fragments, ...) may change the JSON form
+        super().__setattr__(name, value)
+        if name != "_cache":
+            self.__dict__["_cache"] = {}
+
+    def _clear_cache(self):
+        """Must be called after modifying geometry or any list attribute in place"""
+        self._cache = {}
+
     @property
     def symbols(self):
         return self._symbols
@@ -358,6 +389,9 @@ class Molecule(object):
 
         if data is None:
             data = self.to_json()
+            if not self._trusted:
+                # to_json has already validated it
+                return
 
         schema.validate(data, "molecule")
 
@@ -472,10 +506,61 @@ class Molecule(object):
             if sum(phase_check) == 3:
                 break
 
+        self._clear_cache()
+
     def shift_to_com(self):
         """Move coords to center of mass"""
         self.geometry -= np.average(self.geometry, axis=0, weights=self.masses)
 
+### Symmetry methods
+
+    def symmetry_operations(self, tol=SYMMETRY_TOL):
+        """
+        Finds the operations of D2h (elements along the Cartesian axes) that leave the molecule unchanged.
+
+        Returns a list of (label, matrix, atom_map) where the operation `matrix` takes atom i onto atom atom_map[i].
+        In the inertial frame (see :py:meth:`orient_molecule`) this is the same largest abelian subgroup most quantum
+        chemistry codes run in, for symmetric tops some elements of the full point group may be missed.
+        """
+        geom = self.geometry
+        # atoms are only equivalent if they are the same element, isotope and ghost status
+        real = self.real if len(self.real) else [True] * len(self.symbols)
+        labels = np.array(["%s %s %.*f" % (sym, r, MASS_NOISE, m) for sym, r, m in zip(self.symbols, real, self.masses)])
+        same_atom = labels[:, None] == labels[None, :]
+
+        ops = []
+        for label, diag in _D2H_OPERATIONS:
+            image = geom * np.array(diag, dtype=float)
+            dist = np.linalg.norm(image[:, None, :] - geom[None, :, :], axis=2)
+            dist[~same_atom] = np.inf
+            atom_map = np.argmin(dist, axis=1)
+            if np.all(dist[np.arange(len(atom_map)), atom_map] < tol) and \
+                    len(set(atom_map.tolist())) == len(atom_map):
+                ops.append((label, np.diag(np.array(diag, dtype=float)), atom_map))
+        return ops
+
+    def point_group(self, tol=SYMMETRY_TOL):
+        """
+        Returns the Schoenflies symbol of the subgroup of D2h found by :py:meth:`symmetry_operations`.
+        """
+        labels = [op[0] for op in self.symmetry_operations(tol)]
+        n_c2 = sum(x.startswith("C2") for x in labels)
+        if len(labels) == 8:
+            return "D2h"
+        elif len(labels) == 4:
+            if n_c2 == 3:
+                return "D2"
+            elif "i" in labels:
+                return "C2h"
+            return "C2v"
+        elif len(labels) == 2:
+            if n_c2:
+                return "C2"
+            elif "i" in labels:
+                return "Ci"
+            return "Cs"
+        return "C1"
+
     def get_fragment(self, real, ghost=None, orient=True):
         """
         A list of real and ghost fragments:
@@ -619,7 +704,11 @@ class Molecule(object):
     def to_json(self):
         """
         Returns a JSON form of the Molecule object.
+
+        The validated JSON is cached until the molecule is changed, each call returns a new copy of it.
         """
+        if "json" in self._cache:
+            return copy.deepcopy(self._cache["json"])
 
         np.set_printoptions(precision=16)
         ret = {}
@@ -641,13 +730,24 @@ class Molecule(object):
             else:
                 ret[field] = data
 
-        self.validate(data=ret)
-        return ret
+        schema.validate(ret, "molecule", trusted=self._trusted)
+        self._cache["json"] = ret
+        return copy.deepcopy(ret)
+
+    def get_hash(self, version=schema.DEFAULT_HASH_VERSION):
+        """
+        Returns the hash of the molecule, cached until the molecule is changed.
+        """
+        key = ("hash", version)
+        if key not in self._cache:
+            tmp_json = self.to_json()
+            self._cache[key] = schema.compute_hash(tmp_json, 'molecule', version)
+        return self._cache[key]
 
-    def get_hash(self):
+    def get_hashes(self, geometries, version=schema.DEFAULT_HASH_VERSION):
         """
-        Returns the hash of the molecule.
+        Returns the hash this molecule would have at each of a stack of (nbatch, natom, 3) `geometries` [a0], without
+        building a Molecule for any of them.
         """
-        tmp_json = self.to_json()
-        return schema.compute_hash(tmp_json, 'molecule')
+        return schema.compute_hashes(self.to_json(), 'molecule', 'geometry', geometries, GEOMETRY_NOISE, version)
 
@@ -0,0 +1,88 @@
+"""
+Cache of completed job directories keyed on the hash of the molecule and model chemistry, so a calculation that has
+already been done (the equilibrium geometry of a rerun, the same displaced point in another stencil) is never run twice
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from . import schema
+from .vibcorr import load_result
+
+# Root of the cache, should be on a filesystem shared by all job sets
+RESULT_CACHE_ENV = 'ORV_RESULT_CACHE'
+
+
+def result_key(molecule_json, job_spec):
+    """
+    The key of the result of running `job_spec` on the molecule `molecule_json`.
+
+    This is the result hash (molecule_id, method, basis, driver, program), with the program_options folded in when
+    given since they change what is computed (e.g. the wavelengths of a rotation).
+    """
+    data = {'molecule_id': schema.compute_hash(molecule_json, 'molecule')}
+    for field in schema.get_hash_fields('result'):
+        if field in job_spec:
+            data[field] = job_spec[field]
+    key = schema.compute_hash(data, 'result')
+    options = job_spec.get('program_options')
+    if options:
+        key = hashlib.sha256((key + json.dumps(options, sort_keys=True)).encode("utf-8")).hexdigest()
+    return key
+
+
+class ResultCache(object):
+    """
+    Links from result keys to the job directories holding a successful output.json.
+
+    Parameters
+    ----------
+    root : str or Path, optional
+        Directory of the cache, read from ORV_RESULT_CACHE if not given.
+    """
+
+    def __init__(self, root=None):
+        if root is None:
+            root = os.environ.get(RESULT_CACHE_ENV, 'result_cache')
+        self.root = Path(root).resolve()
+
+    def _link_path(self, key):
+        return self.root / key[:2] / key
+
+    def lookup(self, key):
+        "The job directory of a successful result for `key`, or None"
+        link = self._link_path(key)
+        if not link.exists():
+            return None
+        job_dir = link.resolve()
+        if load_result(job_dir) is None:
+            return None
+        return job_dir
+
+    def register(self, key, job_dir):
+        "Records `job_dir` as the result for `key` if it succeeded, returns True if it was added"
+        job_dir = Path(job_dir).resolve()
+        if load_result(job_dir) is None:
+            return False
+        link = self._link_path(key)
+        if link.exists() or link.is_symlink():
+            if link.resolve() == job_dir:
+                return False
+            link.unlink()
+        link.parent.mkdir(parents=True, exist_ok=True)
+        link.symlink_to(job_dir, target_is_directory=True)
+        return True
+
+    def register_job_set(self, job_set_dir):
+        "Registers every successful job of a job set (keys are read from each input.json), returns how many were added"
+        count = 0
+        for job_dir in sorted(Path(job_set_dir).iterdir()):
+            input_path = job_dir / 'input.json'
+            if job_dir.is_symlink() or not input_path.exists():
+                continue
+            key = json.loads(input_path.read_text()).get('_id')
+            if key and self.register(key, job_dir):
+                count += 1
+        return count
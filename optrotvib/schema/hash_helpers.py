@@ -4,6 +4,7 @@ Helpers to hash complex objects
 
 import hashlib
 import json
+import struct
 
 import numpy as np
 
@@ -11,6 +12,12 @@ from .schema_util import get_hash_fields
 
 HASH_ALGO = hashlib.sha256
 
+# Hash versions: 1 hashes the JSON text of each hash field, 2 hashes a canonical little-endian binary encoding of them.
+# Hashes of different versions never agree, so stored hashes must be looked up with the version they were made with.
+HASH_VERSIONS = (1, 2)
+DEFAULT_HASH_VERSION = 1
+_V2_TAG = b"optrotvib-hash-v2"
+
 def float_prep(array, around):
     """
     Rounds floats to a common value and build positive zero's to prevent hash conflicts.
@@ -31,13 +38,92 @@ def float_prep(array, around):
 
     return array
 
-def compute_hash(data, obj_type):
-    m = HASH_ALGO()
-    concat = ""
-    for field_name in get_hash_fields(obj_type):
+def _canonical_bytes(value):
+    """
+    Canonical binary encoding of a JSON-like value, every number is a little-endian float64 and every container is
+    prefixed by its type and length.
+    """
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return b"s" + struct.pack("<q", len(data)) + data
+    elif isinstance(value, (bool, np.bool_)):
+        return b"b" + struct.pack("<?", bool(value))
+    elif isinstance(value, (int, float, np.number)):
+        return b"f" + struct.pack("<d", float(value))
+    elif isinstance(value, dict):
+        keys = sorted(value.keys())
+        return b"d" + struct.pack("<q", len(keys)) + b"".join(
+            _canonical_bytes(k) + _canonical_bytes(value[k]) for k in keys)
+    elif isinstance(value, np.ndarray) or all(isinstance(x, (bool, int, float, np.number, np.bool_)) for x in value):
+        arr = np.asarray(value)
+        if arr.dtype.kind == "b":
+            return b"B" + struct.pack("<q", arr.size) + arr.astype("u1").tobytes()
+        return b"F" + struct.pack("<q", arr.size) + np.ascontiguousarray(arr, dtype="<f8").tobytes()
+    elif isinstance(value, (list, tuple)):
+        return b"L" + struct.pack("<q", len(value)) + b"".join(_canonical_bytes(x) for x in value)
+    else:
+        raise TypeError("Type '%s' not recognized" % type(value))
+
+
+def _update_v2(m, data, fields):
+    for field_name in fields:
         if field_name not in data:
             continue
-        concat += json.dumps(data[field_name], sort_keys=True)
+        m.update(_canonical_bytes(field_name) + _canonical_bytes(data[field_name]))
+
+
+def compute_hash(data, obj_type, version=DEFAULT_HASH_VERSION):
+    m = HASH_ALGO()
+    if version == 1:
+        concat = ""
+        for field_name in get_hash_fields(obj_type):
+            if field_name not in data:
+                continue
+            concat += json.dumps(data[field_name], sort_keys=True)
 
-    m.update(concat.encode("utf-8"))
+        m.update(concat.encode("utf-8"))
+    elif version == 2:
+        m.update(_V2_TAG)
+        _update_v2(m, data, get_hash_fields(obj_type))
+    else:
+        raise KeyError("Hash version '%s' not recognized." % str(version))
     return m.hexdigest()
+
+
+def compute_hashes(data, obj_type, field, stack, around, version=DEFAULT_HASH_VERSION):
+    """
+    Hashes of `data` with `field` replaced by each entry of `stack` in turn, e.g. the hashes of many displaced
+    geometries of one molecule in one call.
+
+    `stack` is rounded with :py:func:`float_prep` to `around` digits all at once, each entry is flattened as in the
+    JSON form. The result equals calling :py:func:`compute_hash` on each modified `data` with the same `version`.
+    """
+    stack = np.asarray(stack, dtype=float)
+    stack = float_prep(stack.reshape(stack.shape[0], -1), around)
+    fields = get_hash_fields(obj_type)
+    if field not in fields:
+        return [compute_hash(data, obj_type, version)] * stack.shape[0]
+    split = fields.index(field)
+    before, after = fields[:split], fields[split + 1:]
+
+    hashes = []
+    if version == 1:
+        prefix = "".join(json.dumps(data[f], sort_keys=True) for f in before if f in data)
+        suffix = "".join(json.dumps(data[f], sort_keys=True) for f in after if f in data)
+        for row in stack:
+            text = prefix + json.dumps(row.tolist()) + suffix
+            hashes.append(HASH_ALGO(text.encode("utf-8")).hexdigest())
+    elif version == 2:
+        m_prefix = HASH_ALGO(_V2_TAG)
+        _update_v2(m_prefix, data, before)
+        m_prefix.update(_canonical_bytes(field))
+        suffix_bytes = b"".join(_canonical_bytes(f) + _canonical_bytes(data[f]) for f in after if f in data)
+        header = b"F" + struct.pack("<q", stack.shape[1])
+        rows = np.ascontiguousarray(stack, dtype="<f8")
+        for row in rows:
+            m = m_prefix.copy()
+            m.update(header + row.tobytes() + suffix_bytes)
+            hashes.append(m.hexdigest())
+    else:
+        raise KeyError("Hash version '%s' not recognized." % str(version))
+    return hashes
@@ -5,47 +5,62 @@ Assists in grabbing the requisite schema
 import copy
 import glob
 import os
-import jsonschema
 import json
 
 from pathlib import Path
-__all__ = ["get_schema", "validate", "get_hash_fields", "get_valid_fields", "get_indices"]
+__all__ = ["get_schema", "get_validator", "validate", "validate_many", "get_hash_fields", "get_valid_fields", "get_index"]
 
-_schemas = {}
 schemas_root = Path(__file__).parent
-for schema_p in list(schemas_root.glob("*.schema.json")):
-    schema_n = schema_p.name.split('.')[0]
-    _schemas[schema_n] = json.loads(schema_p.read_text())
 
-_definitions = json.loads(Path(schemas_root / 'definitions.json').read_text())
-for sn in _schemas.keys():
-    _schemas[sn]["definitions"] = copy.deepcopy(_definitions)
+# Schemas (and their shared definitions) are read from disk on first use
+_schemas = {}
+_definitions = {}
+
+# One validator per schema, built on first use
+_validators = {}
+
+def _get(name):
+    if name not in _schemas:
+        schema_p = schemas_root / "{}.schema.json".format(name)
+        if not schema_p.exists():
+            raise KeyError("Schema name %s not found." % name)
+        if not _definitions:
+            _definitions.update(json.loads(Path(schemas_root / 'definitions.json').read_text()))
+        schema = json.loads(schema_p.read_text())
+        schema["definitions"] = copy.deepcopy(_definitions)
+        _schemas[name] = schema
+    return _schemas[name]
 
 
 def get_valid_fields(name):
-    if name not in _schemas.keys():
-        raise KeyError("Schema name %s not found." % name)
-    return list(_schemas[name]['properties'].keys())
+    return list(_get(name)['properties'].keys())
 
 def get_index(name):
-    if name not in _schemas.keys():
-        raise KeyError("Schema name %s not found." % name)
-    return copy.deepcopy(_schemas[name].get("index", []))
+    return copy.deepcopy(_get(name).get("index", []))
 
 def get_hash_fields(name):
-    if name not in _schemas.keys():
-        raise KeyError("Schema name %s not found." % name)
-    return copy.deepcopy(_schemas[name]["hash_fields"])
+    return copy.deepcopy(_get(name)["hash_fields"])
 
 def get_schema(name):
-    if name not in _schemas.keys():
-        raise KeyError("Schema name %s not found." % name)
-    return copy.deepcopy(_schemas[name])
-
-def validate(data, schema_name, return_errors=False):
-    schema = get_schema(schema_name)
-    error_gen = jsonschema.Draft4Validator(schema).iter_errors(data)
-    errors = [x for x in error_gen]
+    return copy.deepcopy(_get(name))
+
+def get_validator(name):
+    """
+    Returns the (shared) validator of schema `name`, it must not be modified.
+    """
+    if name not in _validators:
+        import jsonschema
+        _validators[name] = jsonschema.Draft4Validator(_get(name))
+    return _validators[name]
+
+def validate(data, schema_name, return_errors=False, trusted=False):
+    """
+    Validates `data` against schema `schema_name`. With `trusted` (data generated internally from already validated
+    objects) the check is skipped entirely.
+    """
+    if trusted:
+        return True
+    errors = list(get_validator(schema_name).iter_errors(data))
     if len(errors):
         if return_errors:
             return errors
@@ -59,3 +74,29 @@ def validate(data, schema_name, return_errors=False):
             raise ValueError(error_msg)
     else:
         return True
+
+def validate_many(data_list, schema_name, return_errors=False):
+    """
+    Validates every document of `data_list` with the same validator, errors of all documents are collected before
+    raising (or returned as ``{index: [errors]}`` with `return_errors`).
+    """
+    validator = get_validator(schema_name)
+    all_errors = {}
+    for i, data in enumerate(data_list):
+        errors = list(validator.iter_errors(data))
+        if len(errors):
+            all_errors[i] = errors
+    if len(all_errors):
+        if return_errors:
+            return all_errors
+        else:
+            error_msg = "Error validating schema '%s' for %d of %d documents!\n" % (schema_name, len(all_errors),
+                                                                                  len(data_list))
+            for i, errors in all_errors.items():
+                error_msg += "Document %d:\n" % i
+                error_msg += "\n".join("    " + x.message for x in errors)
+                error_msg += "\n"
+
+            raise ValueError(error_msg)
+    else:
+        return True
@@ -0,0 +1,218 @@
+"""
+Displacement stencils along the normal modes of an equilibrium molecule
+"""
+
+import copy
+from collections.abc import Mapping
+
+import numpy as np
+
+from . import findif
+from .molecule import Molecule, SYMMETRY_TOL
+
+# index of each displacement direction in the second axis of Stencil.geometries
+SIGNS = ('p', 'm')
+
+# Largest element of the difference between a (normalized) mode and its symmetry image for them to be considered equal
+MODE_SYMMETRY_TOL = 1.0e-3
+
+
+def mode_name(imode, isign):
+    """The job name of the `isign` displacement of mode `imode`"""
+    return "mode{}_{}".format(imode, SIGNS[isign])
+
+
+def parse_mode_name(name):
+    """Inverse of :py:func:`mode_name`, returns (imode, isign)"""
+    mode, sign = name.rsplit('_', 1)
+    if not mode.startswith("mode") or sign not in SIGNS:
+        raise KeyError("Stencil: '%s' is not a displaced geometry name." % name)
+    return int(mode[4:]), SIGNS.index(sign)
+
+
+class _DisplacedMolecules(Mapping):
+    """
+    Read-only ``{mode name: Molecule}`` view of a stencil, each Molecule is only built when it is looked up.
+    """
+
+    def __init__(self, stencil):
+        self._stencil = stencil
+
+    def __getitem__(self, name):
+        imode, isign = parse_mode_name(name)
+        if imode >= self._stencil.nmode:
+            raise KeyError("Stencil: '%s' is not a displaced geometry name." % name)
+        return self._stencil.molecule(imode, isign)
+
+    def __iter__(self):
+        return iter(self._stencil.mode_names())
+
+    def __len__(self):
+        return len(self._stencil.mode_names())
+
+
+class Stencil(object):
+    """
+    All of the +/- displaced geometries of a molecule along its normal modes.
+
+    The geometries are held as one (nmode, 2, natom, 3) array, Molecule objects are only made (from the equilibrium
+    molecule) when a displaced geometry is requested through ``stencil['modes']`` or :py:meth:`molecule`.
+
+    With `use_symmetry` every displaced geometry that a symmetry operation of the equilibrium molecule takes onto an
+    earlier one is an image of it: the - displacement of a mode that is antisymmetric under the operation, or (in a
+    Cartesian stencil) the displacement of an atom onto the same step of an equivalent atom. Those geometries are left
+    out of ``stencil['modes']`` (and so get no job) and their results are rebuilt with :py:meth:`fill_images`.
+
+    Modes can also be left out entirely with :py:meth:`screen`, e.g. after ranking them with a cheaper model chemistry.
+    """
+
+    def __init__(self, eq_molecule, vibinfo, step_sizes, use_symmetry=False, symmetry_tol=SYMMETRY_TOL):
+        self.eq_molecule = eq_molecule
+        # frequencies and reduced masses are only known for normal mode stencils
+        self.omega = np.asarray(vibinfo['omega']) if 'omega' in vibinfo else None
+        self.mu = np.asarray(vibinfo['mu']) if 'mu' in vibinfo else None
+        self.x = np.asarray(vibinfo['x'])
+        self.step_sizes = np.asarray(step_sizes, dtype=float)
+        if self.step_sizes.shape != (self.nmode, ):
+            raise AttributeError("Stencil: %d step sizes given for %d modes" % (self.step_sizes.size, self.nmode))
+        self.geometries = findif.displaced_geometries(eq_molecule.geometry, self.x, self.step_sizes)
+        # {(imode, isign): (imode, isign, matrix, atom_map)} for the displaced geometries that are the image of a
+        # computed one under the symmetry operation (matrix, atom_map)
+        self.images = {}
+        # modes that are not computed at all
+        self.screened = set()
+        if use_symmetry:
+            self._find_images(symmetry_tol)
+
+    @classmethod
+    def from_vibinfo(cls, eq_molecule, vibinfo, disp_type="wiberg", temperature=298.15, delta_fraction=0.04,
+                     use_symmetry=False):
+        """
+        Builds a stencil with the step sizes of `disp_type`, either "wiberg" (at `temperature`) or "mort" (with
+        `delta_fraction`).
+        """
+        if disp_type == "wiberg":
+            # the wiberg sizes are mass-weighted amplitudes, the step is taken along the normalized (un-mass-weighted) x
+            step_sizes = findif.wiberg_displacement_sizes(vibinfo['omega'], temperature) / np.sqrt(vibinfo['mu'])
+        elif disp_type == "mort":
+            step_sizes = findif.mort_displacment_sizes(vibinfo['x'], delta_fraction)
+        else:
+            raise KeyError("Stencil: disp_type '%s' not recognized." % disp_type)
+        return cls(eq_molecule, vibinfo, step_sizes, use_symmetry=use_symmetry)
+
+    @classmethod
+    def cartesian(cls, eq_molecule, step=0.005, use_symmetry=False):
+        """
+        Builds a stencil of +/- `step` [a0] displacements along each of the 3N Cartesian coordinates, e.g. for a
+        finite difference Hessian from gradients. Mode k is the displacement of atom k // 3 along axis k % 3.
+        """
+        ncoord = 3 * eq_molecule.geometry.shape[0]
+        return cls(eq_molecule, {'x': np.identity(ncoord)}, np.full(ncoord, step), use_symmetry=use_symmetry)
+
+    def _find_images(self, tol):
+        natom = self.eq_molecule.geometry.shape[0]
+        disp = self.x.T.reshape(self.nmode, natom, 3)
+        disp = disp / np.linalg.norm(disp, axis=(1, 2))[:, None, None]
+        flat = disp.reshape(self.nmode, -1)
+        ops = [op for op in self.eq_molecule.symmetry_operations(tol) if op[0] != "E"]
+        # prefer proper rotations, their images need no change of sign for pseudoscalars
+        ops.sort(key=lambda op: -np.linalg.det(op[1]))
+        # each operation takes mode m onto sign[m] * mode target[m] (where match[m])
+        op_maps = []
+        for label, matrix, atom_map in ops:
+            op_disp = np.empty_like(disp)
+            op_disp[:, atom_map] = disp @ matrix.T
+            op_flat = op_disp.reshape(self.nmode, -1)
+            overlap = op_flat @ flat.T
+            target = np.argmax(np.abs(overlap), axis=1)
+            sign = np.sign(overlap[np.arange(self.nmode), target])
+            match = np.max(np.abs(op_flat - sign[:, None] * flat[target]), axis=1) < MODE_SYMMETRY_TOL
+            # the image is only one of the stencil's geometries if the step is the same
+            match &= np.isclose(self.step_sizes, self.step_sizes[target])
+            op_maps.append((matrix, atom_map, target, sign, match))
+
+        # every displacement not yet known to be an image is computed, and all of its images are not
+        computed = set()
+        for imode in range(self.nmode):
+            for isign in range(len(SIGNS)):
+                if (imode, isign) in self.images:
+                    continue
+                computed.add((imode, isign))
+                for matrix, atom_map, target, sign, match in op_maps:
+                    if not match[imode]:
+                        continue
+                    image = (int(target[imode]), isign if sign[imode] > 0 else 1 - isign)
+                    if image not in computed:
+                        self.images.setdefault(image, (imode, isign, matrix, atom_map))
+
+    def __getitem__(self, key):
+        # dict style access as used by generate.generate_jobs_for_stencil
+        if key == "eq_molecule":
+            return self.eq_molecule
+        elif key == "modes":
+            return _DisplacedMolecules(self)
+        else:
+            raise KeyError(key)
+
+    @property
+    def nmode(self):
+        return self.x.shape[1]
+
+    def mode_names(self):
+        """The names of the displaced geometries that need to be computed"""
+        return [
+            mode_name(imode, isign) for imode in range(self.nmode) for isign in range(len(SIGNS))
+            if (imode, isign) not in self.images and imode not in self.screened
+        ]
+
+    def screen(self, keep):
+        """
+        Only compute the modes in `keep`, every other mode is screened out of the stencil.
+        """
+        keep = set(int(x) for x in keep)
+        self.screened = set(range(self.nmode)) - keep
+
+    def active_modes(self):
+        """Boolean (nmode,) mask of the modes that have not been screened out"""
+        mask = np.ones(self.nmode, dtype=bool)
+        mask[list(self.screened)] = False
+        return mask
+
+    def fill_images(self, values, pseudoscalar=True):
+        """
+        Fills in the results of the displaced geometries left out by symmetry from those of their images.
+
+        `values` is an array with leading (nmode, 2) axes, the entries of the left out geometries are overwritten in
+        place and the array is returned. Optical rotation is a pseudoscalar and changes sign under improper operations,
+        pass ``pseudoscalar=False`` for true scalars such as energies.
+        """
+        for (imode, isign), (jmode, jsign, matrix, atom_map) in self.images.items():
+            parity = np.linalg.det(matrix) if pseudoscalar else 1.0
+            values[imode, isign] = values[jmode, jsign] * parity
+        return values
+
+    def fill_vector_images(self, values):
+        """
+        Like :py:meth:`fill_images` for per-atom Cartesian vectors such as gradients, `values` has shape
+        (nmode, 2, natom, 3) and each image is rotated and has its atoms permuted by the symmetry operation.
+        """
+        for (imode, isign), (jmode, jsign, matrix, atom_map) in self.images.items():
+            values[imode, isign][atom_map] = values[jmode, jsign] @ matrix.T
+        return values
+
+    def molecule(self, imode, isign):
+        """
+        The Molecule displaced along mode `imode` in the `isign` direction (0 for +, 1 for -).
+        """
+        eq_mol = self.eq_molecule
+        mol = Molecule(None, name=eq_mol.name)
+        for field in ["comment", "charge", "multiplicity", "real", "fragments", "fragment_charges",
+                      "fragment_multiplicities", "provenance"]:
+            setattr(mol, field, copy.deepcopy(getattr(eq_mol, field)))
+        mol.symbols = list(eq_mol.symbols)
+        if eq_mol._custom_masses:
+            mol.masses = list(eq_mol.masses)
+        mol.geometry = self.geometries[imode, isign]
+        # only the geometry differs from the validated equilibrium molecule
+        mol._trusted = True
+        return mol
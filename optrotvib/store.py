@@ -0,0 +1,202 @@
+"""
+Embedded SQLite store of results and job sets, indexed on the ``index`` fields of the result and stencil schemas
+"""
+
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+from . import schema
+from .result_cache import result_key
+
+# Path of the database file
+RESULT_DB_ENV = 'ORV_RESULT_DB'
+
+_tables = {'result': 'results', 'stencil': 'stencils'}
+
+
+def _column_value(value):
+    # drivers may be lists, anything not a plain string is stored as its JSON text
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+class ResultStore(object):
+    """
+    Results and job sets ingested from job directories into one SQLite file.
+
+    A ``results`` and a ``stencils`` table hold the hash fields of each schema along with the full JSON, each with an
+    index over the schema's ``index`` fields. Results are keyed on their result key, job sets on their name since
+    several job sets (step sizes, screened modes) can share one stencil hash. Rotations are also kept row by row so
+    they can be selected by wavelength and gauge directly.
+
+    Parameters
+    ----------
+    path : str or Path, optional
+        The database file, read from ORV_RESULT_DB (default results.db) if not given.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.environ.get(RESULT_DB_ENV, 'results.db')
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self._create()
+
+    def _create(self):
+        cur = self.conn.cursor()
+        for obj_type, table in _tables.items():
+            fields = schema.get_hash_fields(obj_type)
+            columns = ["{} TEXT".format(f) for f in fields]
+            if obj_type == 'result':
+                columns = ["id TEXT PRIMARY KEY"] + columns + ["success INTEGER", "job_dir TEXT"]
+            else:
+                # the stencil hash is shared by job sets that differ in step sizes or screened modes
+                columns = ["job_set TEXT PRIMARY KEY", "id TEXT"] + columns
+            cur.execute("CREATE TABLE IF NOT EXISTS {} ({}, data TEXT)".format(table, ", ".join(columns)))
+            if obj_type == 'stencil':
+                cur.execute("CREATE INDEX IF NOT EXISTS stencils_id ON stencils (id)")
+            index = schema.get_index(obj_type)
+            if index:
+                cur.execute("CREATE INDEX IF NOT EXISTS {0}_index ON {0} ({1})".format(table, ", ".join(index)))
+        cur.execute("CREATE TABLE IF NOT EXISTS rotations "
+                    "(result_id TEXT, wavelength REAL, gauge TEXT, value REAL)")
+        cur.execute("CREATE INDEX IF NOT EXISTS rotations_index ON rotations (result_id, wavelength, gauge)")
+        cur.execute("CREATE TABLE IF NOT EXISTS stencil_jobs (job_set TEXT, name TEXT, result_id TEXT, "
+                    "PRIMARY KEY (job_set, name))")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _insert(self, table, row):
+        keys = list(row.keys())
+        self.conn.execute("INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+            table, ", ".join(keys), ", ".join("?" * len(keys))), [row[k] for k in keys])
+
+    def _ingest_result(self, job_dir):
+        job_dir = Path(job_dir)
+        input_path = job_dir / 'input.json'
+        output_path = job_dir / 'output.json'
+        if not (input_path.exists() and output_path.exists()):
+            return None
+        job = json.loads(input_path.read_text())
+        result = json.loads(output_path.read_text())
+        modelchem = job['modelchem']
+        rid = job.get('_id') or result_key(job['molecule'], modelchem)
+        row = {'id': rid, 'molecule_id': schema.compute_hash(job['molecule'], 'molecule')}
+        for field in schema.get_hash_fields('result'):
+            if field in modelchem:
+                row[field] = _column_value(modelchem[field])
+        row['success'] = int(bool(result.get('success', False)))
+        row['job_dir'] = str(job_dir.resolve())
+        row['data'] = json.dumps(result)
+        self._insert('results', row)
+
+        self.conn.execute("DELETE FROM rotations WHERE result_id = ?", (rid, ))
+        if row['success']:
+            self.conn.executemany("INSERT INTO rotations VALUES (?, ?, ?, ?)",
+                                  [(rid, r['wavelength'], r['gauge'], r['value'])
+                                   for r in result.get('output', {}).get('rotations', [])])
+        return rid
+
+    def ingest_result(self, job_dir):
+        """Adds (or replaces) the result of the job in `job_dir`, returns its id or None if it has not run"""
+        rid = self._ingest_result(job_dir)
+        self.conn.commit()
+        return rid
+
+    def ingest_job_set(self, stencil, job_set_dir, job_spec):
+        """
+        Adds a job set made by :py:func:`optrotvib.generate.generate_jobs_for_stencil` and the results of all its
+        jobs, the job set is identified by the name of `job_set_dir`. Returns the number of results ingested.
+        """
+        job_set_dir = Path(job_set_dir)
+        job_set = job_set_dir.name
+        data = {'eq_molecule_id': stencil['eq_molecule'].get_hash()}
+        for field in schema.get_hash_fields('stencil'):
+            if field in job_spec:
+                data[field] = job_spec[field]
+        row = dict(data)
+        row['id'] = schema.compute_hash(data, 'stencil')
+        row['job_set'] = job_set
+        stencil_data = {'nmode': stencil.nmode, 'step_sizes': list(map(float, stencil.step_sizes))}
+        if stencil.omega is not None:
+            stencil_data['omega'] = list(map(float, stencil.omega))
+            stencil_data['mu'] = list(map(float, stencil.mu))
+        row['data'] = json.dumps(stencil_data)
+        self._insert('stencils', row)
+        self.conn.execute("DELETE FROM stencil_jobs WHERE job_set = ?", (job_set, ))
+
+        count = 0
+        for name in ["eq"] + stencil.mode_names():
+            rid = self._ingest_result(job_set_dir / name)
+            if rid is None:
+                continue
+            self._insert('stencil_jobs', {'job_set': job_set, 'name': name, 'result_id': rid})
+            count += 1
+        self.conn.commit()
+        return count
+
+    def find_results(self, success=True, **fields):
+        """Rows of the results matching the hash `fields` (e.g. method='b3lyp', driver='rotation')"""
+        clauses = ["success = ?"]
+        values = [int(success)]
+        for field, value in fields.items():
+            if field not in schema.get_hash_fields('result'):
+                raise KeyError("Result field '%s' is not stored." % field)
+            clauses.append("{} = ?".format(field))
+            values.append(_column_value(value))
+        cur = self.conn.execute("SELECT * FROM results WHERE {}".format(" AND ".join(clauses)), values)
+        return cur.fetchall()
+
+    def load_result(self, result_id):
+        "The full result JSON of `result_id`, or None"
+        row = self.conn.execute("SELECT data FROM results WHERE id = ?", (result_id, )).fetchone()
+        return None if row is None else json.loads(row['data'])
+
+    def job_sets(self, stencil):
+        "Names of the job sets for `stencil`, either a job set name or a stencil hash (which may match several)"
+        cur = self.conn.execute("SELECT job_set FROM stencils WHERE job_set = ? OR id = ? ORDER BY job_set",
+                                (stencil, stencil))
+        return [row['job_set'] for row in cur]
+
+    def rotations(self, stencil, wavelength=None, gauge=None):
+        """
+        Rotations of every job of `stencil` (a job set name or a stencil hash) as (job set, name, wavelength, gauge,
+        value) rows, optionally only those at `wavelength` [nm] and/or for `gauge`.
+        """
+        job_sets = self.job_sets(stencil)
+        query = ("SELECT j.job_set, j.name, r.wavelength, r.gauge, r.value FROM stencil_jobs j "
+                 "JOIN rotations r ON r.result_id = j.result_id WHERE j.job_set IN ({})".format(
+                     ", ".join("?" * len(job_sets))))
+        values = list(job_sets)
+        if wavelength is not None:
+            query += " AND r.wavelength = ?"
+            values.append(float(wavelength))
+        if gauge is not None:
+            query += " AND r.gauge = ?"
+            values.append(gauge)
+        return [tuple(row) for row in self.conn.execute(query, values)]
+
+    def stencil_rotation_lists(self, stencil):
+        """
+        {job name: rotation list} of `stencil` (a job set name, or a stencil hash with a single job set) in the form
+        of ``output.rotations``, ready for :py:func:`optrotvib.vibcorr.rotation_array`.
+        """
+        job_sets = self.job_sets(stencil)
+        if len(job_sets) > 1:
+            raise ValueError("Stencil {} has several job sets ({}), pick one".format(stencil, ", ".join(job_sets)))
+        lists = {}
+        for _, name, wavelength, gauge, value in self.rotations(stencil):
+            lists.setdefault(name, []).append({'wavelength': wavelength, 'gauge': gauge, 'value': value})
+        return lists
@@ -1,29 +1,46 @@
 import os
+import json
+import logging
 import subprocess as sp
 import psutil
 import time
 from lxml import etree
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+# qstat executable, can be pointed at a stand-in script to work without a PBS server
+QSTAT_COMMAND = os.environ.get("ORV_QSTAT", "qstat")
+# seconds a batch of job states is reused before qstat is asked again
+QSTAT_TTL = float(os.environ.get("ORV_QSTAT_TTL", 30))
+# qsub option requesting a job array, '-t' on torque and '-J' on PBS Pro, the index reaches the job as PBS_ARRAYID
+# (torque) or PBS_ARRAY_INDEX (PBS Pro)
+ARRAY_FLAG = os.environ.get("ORV_PBS_ARRAY_FLAG", "-t")
+ARRAY_SCRIPT = "submit_array.pbs"
+# run in the job directory by the scripts, with the python set up by the compute_env lines (as local_submit does)
+ENGINE_COMMAND = "python -m optrotvib.engine.cli"
+ARRAY_LIST = "jobs.list"
+
 class temporary_move(object):
-    def __init__(self):
+    def __init__(self, t_dir):
+        self.t_dir = t_dir
         self.return_dir = None
 
-    def __enter__(self, t_dir):
+    def __enter__(self):
         self.return_dir = Path.cwd()
-        os.chdir(str(t_dir))
+        os.chdir(str(self.t_dir))
 
     def __exit__(self, *exc):
         os.chdir(str(self.return_dir))
 
 
-def qsub(args):
+def qsub(args, script="submit.pbs"):
     full_args = "-W group_list={} {}".format(os.environ.get("SYSNAME"), args)
-    proc = sp.run("qsub {} submit.pbs".format(full_args), shell=True, check=True, universal_newlines=True, stdout=sp.PIPE)
+    proc = sp.run("qsub {} {}".format(full_args, script), shell=True, check=True, universal_newlines=True, stdout=sp.PIPE)
     return proc.stdout.split('.')[0]
 
 def qstat(job_id):
-    proc = sp.run("qstat -x {}".format(job_id), shell=True, stdout=sp.PIPE, universal_newlines=True, check=False)
+    proc = sp.run("{} -x {}".format(QSTAT_COMMAND, job_id), shell=True, stdout=sp.PIPE, universal_newlines=True, check=False)
     # if the job is not found then we will assume it was completed and now is missing
     if proc.returncode != 0:
         return 'C'
@@ -31,25 +48,156 @@ def qstat(job_id):
     logger.info("QSTAT: job {} STATE = '{}'".format(job_id, state))
     return state
 
+def parse_qstat_xml(text):
+    "{job id: state} for every Job in `qstat -x` output, ids without the server suffix"
+    states = {}
+    text = text.strip()
+    if not text:
+        return states
+    for job in etree.XML(text.encode()).iter("Job"):
+        states[job.findtext("Job_Id").split('.')[0]] = job.findtext("job_state")
+    return states
+
+class JobStateCache(object):
+    """
+    States of all jobs on the PBS server from a single `qstat -x`, reused for `ttl` seconds.
+
+    Jobs missing from the listing are assumed to have completed (and been purged), as in :py:func:`qstat`. As a job
+    may have been submitted after the listing was taken, the first miss in a listing asks qstat again before anything
+    is reported complete. Until qstat has answered once every job is reported queued.
+    """
+
+    def __init__(self, ttl=None, command=None):
+        self.ttl = QSTAT_TTL if ttl is None else ttl
+        self.command = QSTAT_COMMAND if command is None else command
+        self._states = {}
+        # time of the last successful listing and of the last qstat call
+        self._time = None
+        self._attempt = None
+        self._rechecked = False
+
+    def stale(self):
+        return self._attempt is None or (time.time() - self._attempt) > self.ttl
+
+    def invalidate(self):
+        "The next lookup asks qstat again, e.g. after submitting jobs"
+        self._attempt = None
+
+    def refresh(self):
+        self._attempt = time.time()
+        # -t lists the elements of job arrays as well
+        proc = sp.run("{} -t -x".format(self.command), shell=True, stdout=sp.PIPE, universal_newlines=True, check=False)
+        if proc.returncode != 0 and not proc.stdout.strip():
+            # keep what we had and ask again next time rather than calling every job complete
+            logger.warning("QSTAT: batch query failed with exit code {}".format(proc.returncode))
+            return self._states
+        self._states = parse_qstat_xml(proc.stdout)
+        self._time = self._attempt
+        self._rechecked = False
+        logger.info("QSTAT: {} jobs listed".format(len(self._states)))
+        return self._states
+
+    def get(self, jid):
+        if self.stale():
+            self.refresh()
+        jid = str(jid).strip().split('.')[0]
+        if jid not in self._states and self._time is not None and not self._rechecked:
+            # submitted since the listing was taken? only checked once per listing
+            self.refresh()
+            self._rechecked = True
+        if self._time is None:
+            return 'Q'
+        return self._states.get(jid, 'C')
+
+    def get_many(self, jids):
+        if self.stale():
+            self.refresh()
+        return {jid: self.get(jid) for jid in jids}
+
+# shared by check_by_dir/check_by_id
+state_cache = JobStateCache()
+
 def write_submit_script(env, job_path):
-    lines = env + ['optrotvib.engine']
+    lines = env + [ENGINE_COMMAND]
     Path(job_path / 'submit.pbs').write_text("\n".join(lines))
 
 def submit(compute_env, qsub_args, compute_dir, job):
-    job_path = compute_dir / job['name']
+    job_path = Path(compute_dir) / job['name']
     if not job_path.exists():
         job_path.mkdir(parents=True)
 
-    write_submit_script(env, job_path)
+    write_submit_script(compute_env, job_path)
     Path(job_path / 'input.json').write_text(json.dumps(job))
     with temporary_move(job_path):
         jid = qsub(qsub_args)
         Path('job.id').write_text(jid)
+    state_cache.invalidate()
     return jid
 
+def array_element_id(array_jid, index):
+    "id of element `index` of the array job `array_jid` (as returned by qsub, e.g. '1234[]')"
+    return "{}[{}]".format(array_jid.split('[')[0], index)
+
+def write_array_script(env, job_set_dir, job_names):
+    """
+    Writes the list of job directories (one per line, in array index order) and the job array script that runs the
+    engine in the directory of its index.
+    """
+    job_set_dir = Path(job_set_dir)
+    Path(job_set_dir / ARRAY_LIST).write_text("\n".join(job_names) + "\n")
+    lines = env + [
+            'cd "${PBS_O_WORKDIR:-.}"',
+            'ARRAY_INDEX=${PBS_ARRAYID:-$PBS_ARRAY_INDEX}',
+            'cd "$(sed -n "$((ARRAY_INDEX + 1))p" ' + ARRAY_LIST + ')"',
+            ENGINE_COMMAND]
+    Path(job_set_dir / ARRAY_SCRIPT).write_text("\n".join(lines))
+
+def submit_array(compute_env, qsub_args, job_set_dir, jobs):
+    """
+    Submits all `jobs` of a job set with a single qsub as one job array, element i runs the job in
+    ``job_set_dir/jobs[i]['name']``.
+
+    Each job directory gets the job.id of its array element, so :py:func:`check_by_dir` reports the state of every
+    element as usual. Returns the array job id, or None if there are no `jobs` (e.g. all were found in the result
+    cache) and nothing was submitted.
+    """
+    if not jobs:
+        return None
+    job_set_dir = Path(job_set_dir)
+    for job in jobs:
+        job_path = job_set_dir / job['name']
+        if not job_path.exists():
+            job_path.mkdir(parents=True)
+        Path(job_path / 'input.json').write_text(json.dumps(job))
+
+    write_array_script(compute_env, job_set_dir, [job['name'] for job in jobs])
+    array_args = "{} 0-{} {}".format(ARRAY_FLAG, len(jobs) - 1, qsub_args)
+    with temporary_move(job_set_dir):
+        array_jid = qsub(array_args, script=ARRAY_SCRIPT)
+        Path('array.id').write_text(array_jid)
+    for i, job in enumerate(jobs):
+        Path(job_set_dir / job['name'] / 'job.id').write_text(array_element_id(array_jid, i))
+    state_cache.invalidate()
+    return array_jid
+
+def check_array(array_jid, njob):
+    "{array index: state} for the `njob` elements of an array job, from (at most) one qstat call"
+    states = check_many_by_id([array_element_id(array_jid, i) for i in range(njob)])
+    return {i: states[array_element_id(array_jid, i)] for i in range(njob)}
+
 def check_by_dir(job_dir):
     jid = Path(job_dir / 'job.id').read_text()
-    return qstat(jid)
+    return check_by_id(jid)
 
 def check_by_id(jid):
-    return qstat(jid)
+    return state_cache.get(jid)
+
+def check_many_by_id(jids):
+    "{job id: state} for all `jids` from (at most) one qstat call"
+    return state_cache.get_many(jids)
+
+def check_many_by_dir(job_dirs):
+    "{job dir: state} for all `job_dirs` from (at most) one qstat call"
+    jids = {job_dir: Path(Path(job_dir) / 'job.id').read_text() for job_dir in job_dirs}
+    states = check_many_by_id(jids.values())
+    return {job_dir: states[jid] for job_dir, jid in jids.items()}
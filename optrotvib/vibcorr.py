@@ -0,0 +1,272 @@
+"""
+Vibrational corrections to optical rotation from the results of a displacement stencil
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from . import findif
+from .stencil import mode_name
+
+
+def load_result(job_dir):
+    """
+    Reads the output.json of a job directory, returns None if it is missing or the job did not succeed.
+    """
+    out_path = Path(job_dir) / 'output.json'
+    if not out_path.exists():
+        return None
+    result = json.loads(out_path.read_text())
+    if not result.get('success', False):
+        return None
+    return result
+
+
+def rotation_array(rotation_lists, wavelengths=None, gauges=None):
+    """
+    Packs the ``output.rotations`` lists of several results into one dense array.
+
+    Parameters
+    ----------
+    rotation_lists : list
+        One list of ``{'value', 'wavelength', 'gauge'}`` rotations (or None for a missing result) per result
+    wavelengths, gauges : list, optional
+        The wavelengths and gauges to keep (in this order), all those found are used by default.
+
+    Returns
+    -------
+    values : ndarray of float
+        (nresult, nwavelength, ngauge) specific rotations, NaN where a result has no value
+    wavelengths : ndarray of float
+    gauges : ndarray of str
+    """
+    rotation_lists = [x if x is not None else [] for x in rotation_lists]
+    job_idx = np.array([i for i, rots in enumerate(rotation_lists) for r in rots], dtype=int)
+    all_wl = np.array([r['wavelength'] for rots in rotation_lists for r in rots], dtype=float)
+    all_gauge = np.array([r['gauge'] for rots in rotation_lists for r in rots], dtype=str)
+    all_value = np.array([r['value'] for rots in rotation_lists for r in rots], dtype=float)
+
+    wavelengths = np.unique(all_wl) if wavelengths is None else np.asarray(wavelengths, dtype=float)
+    gauges = np.unique(all_gauge) if gauges is None else np.asarray(gauges, dtype=str)
+
+    values = np.full((len(rotation_lists), len(wavelengths), len(gauges)), np.nan)
+    wl_order = np.argsort(wavelengths)
+    gauge_order = np.argsort(gauges)
+    wl_pos = np.searchsorted(wavelengths[wl_order], all_wl).clip(max=max(len(wavelengths) - 1, 0))
+    gauge_pos = np.searchsorted(gauges[gauge_order], all_gauge).clip(max=max(len(gauges) - 1, 0))
+    if len(all_value):
+        wl_idx = wl_order[wl_pos]
+        gauge_idx = gauge_order[gauge_pos]
+        keep = (wavelengths[wl_idx] == all_wl) & (gauges[gauge_idx] == all_gauge)
+        values[job_idx[keep], wl_idx[keep], gauge_idx[keep]] = all_value[keep]
+    return values, wavelengths, gauges
+
+
+def load_stencil_rotations(stencil, job_set_dir, wavelengths=None, gauges=None):
+    """
+    Loads the rotations of the equilibrium and every displaced geometry of `stencil` from the job directories in
+    `job_set_dir` (as laid out by :py:func:`optrotvib.generate.generate_jobs_for_stencil`).
+
+    Geometries left out of the stencil by symmetry are rebuilt from their images.
+
+    Returns
+    -------
+    eq : ndarray of float
+        (nwavelength, ngauge) rotations at the equilibrium geometry
+    disp : ndarray of float
+        (nmode, 2, nwavelength, ngauge) rotations at the +/- displaced geometries
+    wavelengths : ndarray of float
+    gauges : ndarray of str
+    """
+    job_set_dir = Path(job_set_dir)
+    names = ["eq"] + [mode_name(imode, isign) for imode in range(stencil.nmode) for isign in range(2)]
+    computed = set(stencil.mode_names())
+    rot_lists = []
+    for name in names:
+        result = load_result(job_set_dir / name) if (name == "eq" or name in computed) else None
+        rot_lists.append(result['output'].get('rotations') if result is not None else None)
+
+    values, wavelengths, gauges = rotation_array(rot_lists, wavelengths, gauges)
+    disp = stencil.fill_images(values[1:].reshape((stencil.nmode, 2) + values.shape[1:]))
+    return values[0], disp, wavelengths, gauges
+
+
+def vibrational_correction(eq, disp, step_sizes, omega, mu, temp=0.0):
+    """
+    Per mode harmonic vibrational correction to a property from central finite differences.
+
+    Each mode contributes 1/2 d^2P/ds^2 <s^2>, where s is the displacement along the normalized un-mass-weighted mode
+    and <s^2> its thermal mean square amplitude at `temp` (see :py:func:`optrotvib.findif.mean_square_amplitudes`).
+    Everything is evaluated for all modes, wavelengths and gauges at once.
+
+    Parameters
+    ----------
+    eq : ndarray of float
+        (...) property at the equilibrium geometry, e.g. (nwavelength, ngauge)
+    disp : ndarray of float
+        (nmode, 2, ...) property at the +/- displaced geometries
+    step_sizes : ndarray of float
+        (nmode,) displacement along each mode [a0]
+    omega, mu : ndarray of float
+        (nmode,) frequencies [cm^-1] and reduced masses [u] from :py:func:`optrotvib.findif.get_vibinfo`
+    temp : float or ndarray of float
+        Temperature(s) [K], 0 for the zero point correction
+
+    Returns
+    -------
+    ndarray of float
+        (nmode, ...) contribution of each mode, the total correction is the sum over the mode axis. For an array of
+        temperatures a leading (ntemp,) axis is added.
+    """
+    coeffs = fit_even_curves(eq, [disp], [step_sizes])
+    return thermal_correction(coeffs, omega, mu, temp)
+
+
+def fit_even_curves(eq, disps, step_sizes):
+    """
+    Fits the even part of the property along each mode to a polynomial in the step size.
+
+    With results from n stencils that differ only in their step sizes, the even part of the property along mode i,
+    (P(+s) + P(-s)) / 2 - P0, is fit to c_1 s^2 + ... + c_n s^(2n) for every mode, wavelength and gauge at once. One
+    stencil gives the usual central difference c_1 = 1/2 d^2P/ds^2.
+
+    Parameters
+    ----------
+    eq : ndarray of float
+        (...) property at the equilibrium geometry
+    disps : list of ndarray of float
+        One (nmode, 2, ...) array of properties at the +/- displaced geometries per stencil
+    step_sizes : list of ndarray of float
+        One (nmode,) array of step sizes [a0] per stencil
+
+    Returns
+    -------
+    ndarray of float
+        (nmode, n, ...) polynomial coefficients, lowest power first
+    """
+    eq = np.asarray(eq, dtype=float)
+    even = np.stack([0.5 * (d[:, 0] + d[:, 1]) - eq[None] for d in map(np.asarray, disps)], axis=1)
+    steps = np.stack([np.asarray(x, dtype=float) for x in step_sizes], axis=1)
+    nmode, nstep = steps.shape
+    powers = 2 * np.arange(1, nstep + 1)
+    design = steps[:, :, None]**powers[None, None, :]
+    coeffs = np.linalg.pinv(design) @ even.reshape(nmode, nstep, -1)
+    return coeffs.reshape((nmode, nstep) + even.shape[2:])
+
+
+def thermal_correction(coeffs, omega, mu, temp):
+    """
+    Thermal average of the fitted curves of :py:func:`fit_even_curves` over the harmonic vibrational wavefunction.
+
+    The harmonic averages <s^2k> = (2k-1)!! <s^2>^k are used, so any number of temperatures can be evaluated without
+    any new displaced calculations.
+
+    Returns
+    -------
+    ndarray of float
+        (nmode, ...) contribution of each mode, or (ntemp, nmode, ...) for an array of temperatures
+    """
+    coeffs = np.asarray(coeffs, dtype=float)
+    nterm = coeffs.shape[1]
+    msa = findif.mean_square_amplitudes(omega, mu, temp)
+    k = np.arange(1, nterm + 1)
+    double_fact = np.cumprod(2 * k - 1)
+    moments = double_fact * msa[..., None]**k
+    moments = moments.reshape(moments.shape + (1,) * (coeffs.ndim - 2))
+    return np.sum(coeffs * moments, axis=-coeffs.ndim + 1)
+
+
+def stencil_correction(stencil, job_set_dir, temp=0.0, wavelengths=None, gauges=None):
+    """
+    Loads a stencil's results and computes the vibrational correction to the rotation in one pass.
+
+    Modes screened out of the stencil contribute nothing to the correction.
+
+    Returns a dict with the 'wavelengths' and 'gauges' axes, the 'equilibrium' rotations (nwavelength, ngauge), the
+    per 'mode' contributions (nmode, nwavelength, ngauge) and their sum, the total 'correction'.
+    """
+    eq, disp, wavelengths, gauges = load_stencil_rotations(stencil, job_set_dir, wavelengths, gauges)
+    per_mode = vibrational_correction(eq, disp, stencil.step_sizes, stencil.omega, stencil.mu, temp)
+    per_mode[~stencil.active_modes()] = 0.0
+    return {
+        'wavelengths': wavelengths,
+        'gauges': gauges,
+        'equilibrium': eq,
+        'mode': per_mode,
+        'correction': per_mode.sum(axis=0),
+    }
+
+
+def stencil_temperature_sweep(stencils, job_set_dirs, temps, wavelengths=None, gauges=None):
+    """
+    Vibrational corrections at every temperature in `temps` from one or more stencils of the same molecule.
+
+    The stencils should differ only in their step sizes, with n of them the per-mode curves are fit to order 2n in the
+    step (see :py:func:`fit_even_curves`). The equilibrium result is taken from the first job set.
+
+    Returns a dict like :py:func:`stencil_correction` with 'temperatures' and a leading (ntemp,) axis on 'mode' and
+    'correction'.
+    """
+    if len(set(st.nmode for st in stencils)) != 1:
+        raise ValueError("All stencils of a temperature sweep must have the same modes")
+    eq = None
+    disps = []
+    for stencil, job_set_dir in zip(stencils, job_set_dirs):
+        st_eq, disp, wavelengths, gauges = load_stencil_rotations(stencil, job_set_dir, wavelengths, gauges)
+        if eq is None:
+            eq = st_eq
+        disps.append(disp)
+
+    coeffs = fit_even_curves(eq, disps, [st.step_sizes for st in stencils])
+    temps = np.atleast_1d(np.asarray(temps, dtype=float))
+    per_mode = thermal_correction(coeffs, stencils[0].omega, stencils[0].mu, temps)
+    per_mode[:, ~stencils[0].active_modes()] = 0.0
+    return {
+        'temperatures': temps,
+        'wavelengths': wavelengths,
+        'gauges': gauges,
+        'equilibrium': eq,
+        'mode': per_mode,
+        'correction': per_mode.sum(axis=1),
+    }
+
+
+def select_modes(per_mode, threshold=0.95):
+    """
+    Ranks modes by their (estimated) contribution and picks the ones needed to recover `threshold` of the correction.
+
+    For every wavelength and gauge the largest contributions are taken until their share of the summed absolute
+    contributions reaches `threshold`, and a mode is selected if it is needed for any of them. Modes without an
+    estimate (NaN, e.g. a failed job) are always selected.
+
+    Parameters
+    ----------
+    per_mode : ndarray of float
+        (nmode, ...) contribution of each mode, e.g. the 'mode' entry of :py:func:`stencil_correction` run on a cheap
+        model chemistry
+    threshold : float
+        Cumulative fraction of the correction that the selected modes should recover
+
+    Returns
+    -------
+    ndarray of int
+        Indices of the selected modes
+    """
+    per_mode = np.asarray(per_mode, dtype=float)
+    nmode = per_mode.shape[0]
+    contrib = np.abs(per_mode.reshape(nmode, -1))
+    missing = np.isnan(contrib).any(axis=1)
+    contrib[np.isnan(contrib)] = 0.0
+
+    total = contrib.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(total > 0, contrib / total, 0.0)
+    order = np.argsort(-frac, axis=0, kind='stable')
+    frac_sorted = np.take_along_axis(frac, order, axis=0)
+    # a mode is needed while the share of the modes ranked above it is still short of the threshold
+    needed_sorted = ((np.cumsum(frac_sorted, axis=0) - frac_sorted) < threshold) & (frac_sorted > 0)
+    needed = np.zeros_like(needed_sorted)
+    np.put_along_axis(needed, order, needed_sorted, axis=0)
+    return np.flatnonzero(needed.any(axis=1) | missing)
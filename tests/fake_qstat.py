@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Stand-in for `qstat -x` to exercise job polling without a PBS server
+
+    ORV_QSTAT="python tests/fake_qstat.py"
+
+Job states are read from the JSON file {job id: state} named by FAKE_QSTAT_STATES, each call appends its arguments
+to FAKE_QSTAT_LOG (if set). A missing states file makes qstat fail, as when the server can not be reached.
+"""
+
+import json
+import os
+import sys
+
+
+def main(argv):
+    log_path = os.environ.get('FAKE_QSTAT_LOG')
+    if log_path:
+        with open(log_path, 'a') as f:
+            f.write(" ".join(argv) + "\n")
+
+    states_path = os.environ.get('FAKE_QSTAT_STATES')
+    if not states_path or not os.path.exists(states_path):
+        sys.stderr.write("qstat: cannot connect to server\n")
+        return 1
+    with open(states_path) as f:
+        states = json.load(f)
+
+    # asked for specific jobs, only list those
+    ids = [a for a in argv if not a.startswith('-')]
+    if ids:
+        states = {jid: st for jid, st in states.items() if jid.split('.')[0] in [i.split('.')[0] for i in ids]}
+    jobs = "".join("<Job><Job_Id>{}.fake.server</Job_Id><job_state>{}</job_state></Job>".format(jid, st)
+                   for jid, st in states.items())
+    if jobs:
+        sys.stdout.write("<Data>{}</Data>\n".format(jobs))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
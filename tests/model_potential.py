@@ -0,0 +1,92 @@
+"""
+Model molecules and properties with known symmetry for the stencil and Hessian tests
+"""
+
+import itertools
+
+import numpy as np
+
+WATER = """
+O 0.000000 0.000000 0.117790
+H 0.000000 0.755453 -0.471161
+H 0.000000 -0.755453 -0.471161
+"""
+
+# C2 only, the hydrogens are exchanged by the rotation
+H2O2 = """
+O 0.000000 0.699500 -0.053500
+O 0.000000 -0.699500 -0.053500
+H 0.795000 0.878000 0.428000
+H -0.795000 -0.878000 0.428000
+"""
+
+# planar, Cs, the torsion is the only mode out of the plane
+HONO = """
+N 0.000000 0.000000 0.000000
+O 1.170000 0.000000 0.000000
+O -0.600000 1.200000 0.000000
+H -1.500000 0.950000 0.000000
+"""
+
+
+class Springs(object):
+    "Harmonic springs between all atom pairs, the constant depends on the two elements so the field is symmetric"
+
+    def __init__(self, molecule, stretch=0.95):
+        self.symbols = molecule.symbols
+        geom = molecule.geometry
+        natom = len(self.symbols)
+        self.pairs = [(i, j) for i in range(natom) for j in range(i + 1, natom)]
+        # springs under tension, the gradients are not all zero and planar molecules resist bending out of the plane
+        self.r0 = {p: stretch * np.linalg.norm(geom[p[0]] - geom[p[1]]) for p in self.pairs}
+
+    def k(self, i, j):
+        return 0.1 + 0.2 * (self.symbols[i] == 'O') + 0.2 * (self.symbols[j] == 'O')
+
+    def gradient(self, geom):
+        grad = np.zeros_like(geom)
+        for i, j in self.pairs:
+            r = geom[i] - geom[j]
+            d = np.linalg.norm(r)
+            g = self.k(i, j) * (d - self.r0[(i, j)]) * r / d
+            grad[i] += g
+            grad[j] -= g
+        return grad
+
+    def hessian(self, geom):
+        natom = geom.shape[0]
+        hess = np.zeros((natom, 3, natom, 3))
+        for i, j in self.pairs:
+            r = geom[i] - geom[j]
+            d = np.linalg.norm(r)
+            u = r / d
+            ratio = self.r0[(i, j)] / d
+            block = self.k(i, j) * ((1.0 - ratio) * np.identity(3) + ratio * np.outer(u, u))
+            hess[i, :, i] += block
+            hess[j, :, j] += block
+            hess[i, :, j] -= block
+            hess[j, :, i] -= block
+        return hess.reshape(3 * natom, 3 * natom)
+
+
+def _weight(symbol):
+    return {'H': 1.0, 'N': 1.5, 'O': 2.0}[symbol]
+
+
+def scalar(symbols, geom):
+    "A true scalar, the same at symmetry equivalent geometries"
+    w = np.array([_weight(sym) for sym in symbols])
+    dist = np.linalg.norm(geom[:, None] - geom[None, :], axis=2)
+    return np.sum(w[:, None] * w[None, :]**2 * dist**2) + np.sum(w * np.linalg.norm(geom, axis=1)**3)
+
+
+def pseudoscalar(symbols, geom):
+    """
+    A pseudoscalar like the optical rotation, it changes sign under improper operations (those with a negative
+    determinant), the molecule is taken to be at the origin.
+    """
+    value = 0.0
+    for i, j, k in itertools.permutations(range(len(symbols)), 3):
+        weight = _weight(symbols[i]) * _weight(symbols[j])**2 * np.linalg.norm(geom[i]) * np.linalg.norm(geom[k])**2
+        value += weight * np.linalg.det(np.array([geom[i], geom[j], geom[k]]))
+    return value
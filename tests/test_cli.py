@@ -0,0 +1,25 @@
+"""
+Results written by optrotvib.engine.cli
+"""
+
+import json
+
+from optrotvib.engine import cli, instrument
+
+
+def test_finish_adds_compute_info(tmp_path):
+    instrument.start(tmp_path)
+    with instrument.phase('engine'):
+        output_json = {'output': {'rotations': []}, 'raw_output': {}, 'success': True, '_id': 'abc'}
+    cli.finish(output_json, tmp_path)
+
+    result = json.loads((tmp_path / 'output.json').read_text())
+    assert result['success'] and result['_id'] == 'abc'
+    info = result['compute_info']
+    assert [p['name'] for p in info['phases']] == ['engine']
+    assert 0.0 <= info['cpu_utilization'] <= 1.0
+
+
+def test_finish_without_recording(tmp_path):
+    cli.finish({'success': False}, tmp_path)
+    assert json.loads((tmp_path / 'output.json').read_text()) == {'success': False}
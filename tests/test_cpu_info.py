@@ -0,0 +1,80 @@
+"""
+cgroup limits of optrotvib.engine.cpu_info read from a fake /proc and cgroup tree
+"""
+
+from optrotvib.engine import cpu_info
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def _fake_proc(tmp_path, monkeypatch, cgroup, mountinfo):
+    _write(tmp_path / 'proc' / 'cgroup', cgroup)
+    _write(tmp_path / 'proc' / 'mountinfo', mountinfo)
+    monkeypatch.setattr(cpu_info, '_PROC_CGROUP', str(tmp_path / 'proc' / 'cgroup'))
+    monkeypatch.setattr(cpu_info, '_PROC_MOUNTINFO', str(tmp_path / 'proc' / 'mountinfo'))
+
+
+def test_v1_pbs_job_cgroup(tmp_path, monkeypatch):
+    fs = tmp_path / 'cgroup'
+    job = "/pbspro.service/jobid/1234.server"
+    _fake_proc(tmp_path, monkeypatch,
+               "4:memory:{0}\n3:cpu,cpuacct:{0}\n0::/\n".format(job),
+               "33 32 0:29 / {0}/cpu,cpuacct rw - cgroup cgroup rw,cpu,cpuacct\n"
+               "36 32 0:32 / {0}/memory rw - cgroup cgroup rw,memory\n".format(fs))
+    # unlimited at the root, limited for the job, and tighter still one level up
+    _write(fs / 'memory' / 'memory.limit_in_bytes', str(2**63 - 4096))
+    _write(fs / 'memory' / 'memory.usage_in_bytes', str(50 * 2**30))
+    _write(fs / 'memory' / 'pbspro.service' / 'memory.limit_in_bytes', str(16 * 2**30))
+    _write(fs / 'memory' / 'pbspro.service' / 'memory.usage_in_bytes', str(12 * 2**30))
+    _write(fs / 'memory' / 'pbspro.service' / 'memory.stat', "cache {0}\ntotal_inactive_file {0}\n".format(2**30))
+    _write(fs / 'memory' / job.strip('/') / 'memory.limit_in_bytes', str(8 * 2**30))
+    _write(fs / 'memory' / job.strip('/') / 'memory.usage_in_bytes', str(1 * 2**30))
+    _write(fs / 'cpu,cpuacct' / 'cpu.cfs_quota_us', "-1")
+    _write(fs / 'cpu,cpuacct' / 'cpu.cfs_period_us', "100000")
+    _write(fs / 'cpu,cpuacct' / job.strip('/') / 'cpu.cfs_quota_us', "400000")
+    _write(fs / 'cpu,cpuacct' / job.strip('/') / 'cpu.cfs_period_us', "100000")
+
+    assert cpu_info.cgroup_cores() == 4
+    assert cpu_info.cgroup_memory() == 5 * 1024
+
+
+def test_v2_job_cgroup(tmp_path, monkeypatch):
+    fs = tmp_path / 'cgroup'
+    job = "/system.slice/pbs_job_1234"
+    _fake_proc(tmp_path, monkeypatch, "0::{}\n".format(job),
+               "42 32 0:38 / {} rw - cgroup2 cgroup2 rw\n".format(fs))
+    _write(fs / 'memory.max', "max")
+    _write(fs / 'cpu.max', "max 100000")
+    _write(fs / job.strip('/') / 'memory.max', str(4 * 2**30))
+    _write(fs / job.strip('/') / 'memory.current', str(2**30))
+    _write(fs / job.strip('/') / 'cpu.max', "250000 100000")
+
+    assert cpu_info.cgroup_cores() == 2
+    assert cpu_info.cgroup_memory() == 3 * 1024
+
+
+def test_page_cache_is_free(tmp_path, monkeypatch):
+    fs = tmp_path / 'cgroup'
+    job = "/system.slice/pbs_job_1234"
+    _fake_proc(tmp_path, monkeypatch, "0::{}\n".format(job),
+               "42 32 0:38 / {} rw - cgroup2 cgroup2 rw\n".format(fs))
+    # a large checkpoint was just written, most of the usage is cache
+    _write(fs / job.strip('/') / 'memory.max', str(4 * 2**30))
+    _write(fs / job.strip('/') / 'memory.current', str(4 * 2**30))
+    _write(fs / job.strip('/') / 'memory.stat',
+           "anon {}\nfile {}\ninactive_file {}\n".format(2**30, 3 * 2**30, 5 * 2**29))
+
+    assert cpu_info.cgroup_memory() == 2560
+
+
+def test_unlimited(tmp_path, monkeypatch):
+    fs = tmp_path / 'cgroup'
+    _fake_proc(tmp_path, monkeypatch, "0::/\n", "42 32 0:38 / {} rw - cgroup2 cgroup2 rw\n".format(fs))
+    _write(fs / 'memory.max', "max")
+    _write(fs / 'cpu.max', "max 100000")
+
+    assert cpu_info.cgroup_cores() is None
+    assert cpu_info.cgroup_memory() is None
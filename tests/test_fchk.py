@@ -0,0 +1,94 @@
+"""
+The formatted checkpoint reader of the g09 engine on a small synthetic fchk
+"""
+
+import numpy as np
+import pytest
+
+g09_engine = pytest.importorskip('optrotvib.engine.g09_engine')
+
+NATOM = 3
+
+
+def _section(title, dtype, values=None, value=None):
+    if values is None:
+        return ["{:<43}{}     {:>12}".format(title, dtype, value)]
+    lines = ["{:<43}{}   N={:>12}".format(title, dtype, len(values))]
+    if dtype == 'I':
+        fmt, per_line = "{:>12d}", 6
+    elif dtype == 'C':
+        fmt, per_line = "{:<12}", 5
+    else:
+        fmt, per_line = "{:>16.8E}", 5
+    for i in range(0, len(values), per_line):
+        lines.append("".join(fmt.format(v) for v in values[i:i + per_line]))
+    return lines
+
+
+def _hessian():
+    rng = np.random.default_rng(13)
+    h = rng.normal(size=(3 * NATOM, 3 * NATOM))
+    return h + h.T
+
+
+def _write_fchk(path, hessian, gradient):
+    lines = ["water gradient", "Freq      RB3LYP                                                      STO-3G"]
+    lines += _section("Number of atoms", 'I', value=NATOM)
+    lines += _section("Total Energy", 'R', value="-7.531671498000000E+01")
+    lines += _section("Route", 'C', ["#P Freq B3LY", "P/STO-3G nos", "ymm"])
+    lines += _section("Atomic numbers", 'I', [8, 1, 1])
+    lines += _section("Real atomic weights", 'R', [15.9949146, 1.00782504, 1.00782504])
+    lines += _section("Cartesian Gradient", 'R', list(gradient))
+    # stored as the lower triangle, row by row
+    lines += _section("Cartesian Force Constants", 'R', list(hessian[np.tril_indices(3 * NATOM)]))
+    # the last section runs to the end of the file
+    lines += _section("Dipole Moment", 'R', [0.0, 0.0, -0.6])
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_fchk_sections(tmp_path):
+    gradient = np.linspace(-0.01, 0.01, 3 * NATOM)
+    path = tmp_path / 'vices.fchk'
+    _write_fchk(path, _hessian(), gradient)
+
+    fchk = g09_engine.FchkFile(path)
+    try:
+        assert "Cartesian Gradient" in fchk and "Polarizability" not in fchk
+        assert fchk.get("Polarizability") is None
+        assert fchk.get("Number of atoms") == NATOM
+        assert fchk.get("Total Energy") == pytest.approx(-75.31671498)
+        assert fchk.get("Route").strip() == "#P Freq B3LYP/STO-3G nosymm"
+        atomic_numbers = fchk.get("Atomic numbers")
+        assert atomic_numbers.dtype.kind == 'i' and atomic_numbers.tolist() == [8, 1, 1]
+        assert np.allclose(fchk.get("Real atomic weights"), [15.9949146, 1.00782504, 1.00782504])
+        assert np.allclose(fchk.get("Cartesian Gradient"), gradient)
+        assert np.allclose(fchk.get("Dipole Moment"), [0.0, 0.0, -0.6])
+    finally:
+        fchk.close()
+
+
+def test_collect_hessian_and_gradient(tmp_path):
+    hessian = _hessian()
+    gradient = np.linspace(-0.01, 0.01, 3 * NATOM)
+    path = tmp_path / 'vices.fchk'
+    _write_fchk(path, hessian, gradient)
+
+    fchk = g09_engine.FchkFile(path)
+    try:
+        assert np.allclose(g09_engine.collect_hessian(fchk, NATOM), hessian, atol=1.0e-7)
+        assert np.allclose(g09_engine.collect_gradient(fchk), gradient)
+    finally:
+        fchk.close()
+
+
+def test_collect_all_zero(tmp_path):
+    # a job that computed neither (e.g. a rotation) leaves zeros in the checkpoint
+    path = tmp_path / 'vices.fchk'
+    _write_fchk(path, np.zeros((3 * NATOM, 3 * NATOM)), np.zeros(3 * NATOM))
+
+    fchk = g09_engine.FchkFile(path)
+    try:
+        assert g09_engine.collect_hessian(fchk, NATOM) is None
+        assert g09_engine.collect_gradient(fchk) is None
+    finally:
+        fchk.close()
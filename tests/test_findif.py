@@ -0,0 +1,100 @@
+"""
+Normal modes of optrotvib.findif: the low-rank projection, the partial eigensolver and the batched get_vibinfo
+against the dense projector, on the spring model of H2O2
+"""
+
+import numpy as np
+import pytest
+
+from model_potential import H2O2, Springs
+from optrotvib import findif
+from optrotvib.molecule import Molecule
+
+# masses of O, O, H, H
+MASSES = np.array([15.99491462, 15.99491462, 1.00782503, 1.00782503])
+# HOOD and H18O-OH, the center of mass moves with the substitution
+ISOTOPOLOGUES = [MASSES, MASSES * [1, 1, 1, 2.01410178 / 1.00782503], MASSES * [17.9991610 / 15.99491462, 1, 1, 1]]
+
+
+def _to_com(geom, mass):
+    return geom - np.average(geom, axis=0, weights=mass)
+
+
+@pytest.fixture
+def model():
+    mol = Molecule(H2O2)
+    return Springs(mol).hessian(mol.geometry), _to_com(mol.geometry, MASSES)
+
+
+def _dense_reference(hess, geom, mass):
+    # the full projector P.T H P of get_vibinfo before the rank-nrt update
+    TRspace = findif._get_TR_space(mass, geom, space='TR', tol=findif.LINEAR_A_TOL)
+    P = np.identity(3 * len(mass)) - TRspace.T @ TRspace
+    sqrtmmminv = 1.0 / np.repeat(np.sqrt(mass), 3)
+    force_constant_au, qL = np.linalg.eigh(P.T @ (hess * sqrtmmminv[:, None] * sqrtmmminv[None, :]) @ P)
+    keep = np.abs(force_constant_au) > 1.0e-5
+    return force_constant_au[keep], qL[:, keep]
+
+
+def _same_modes(q, ref):
+    # normal modes are only defined up to their sign
+    return np.allclose(np.abs(np.sum(q * ref, axis=-2)), 1.0, atol=1.0e-8)
+
+
+def test_project_TR(model):
+    hess, geom = model
+    TRspace = findif._get_TR_space(MASSES, _to_com(geom, MASSES), space='TR', tol=findif.LINEAR_A_TOL)
+    P = np.identity(hess.shape[0]) - TRspace.T @ TRspace
+    mat = np.random.default_rng(1).normal(size=hess.shape)
+    mat = mat + mat.T
+    assert np.allclose(findif._project_TR(mat, TRspace), P.T @ mat @ P)
+    # stacked
+    projected = findif._project_TR(np.stack([mat, 2 * mat]), np.stack([TRspace, TRspace]))
+    assert np.allclose(projected[1], 2 * P.T @ mat @ P)
+
+
+def test_get_vibinfo_dense_reference(model):
+    hess, geom = model
+    vibinfo = findif.get_vibinfo(hess, geom, MASSES)
+    force_constant_au, qL = _dense_reference(hess, geom, MASSES)
+    assert len(vibinfo['omega']) == 6
+    assert np.allclose(vibinfo['f'], force_constant_au)
+    assert _same_modes(vibinfo['q'], qL)
+
+
+@pytest.mark.parametrize("modes, lo, hi", [(3, 0, 3), ((2, 5), 2, 5), ((0, 6), 0, 6)])
+def test_get_vibinfo_partial(model, modes, lo, hi):
+    hess, geom = model
+    full = findif.get_vibinfo(hess, geom, MASSES)
+    part = findif.get_vibinfo(hess, geom, MASSES, modes=modes)
+    assert np.allclose(part['omega'], full['omega'][lo:hi])
+    assert np.allclose(part['mu'], full['mu'][lo:hi])
+    assert _same_modes(part['q'], full['q'][:, lo:hi])
+
+
+def test_get_vibinfo_batch(model):
+    hess, geom = model
+    batch = findif.get_vibinfo_batch(hess, geom, np.array(ISOTOPOLOGUES))
+    for b, mass in enumerate(ISOTOPOLOGUES):
+        # get_vibinfo wants the geometry at the center of mass of each mass set
+        single = findif.get_vibinfo(hess, _to_com(geom, mass), mass)
+        for key in ('f', 'omega', 'mu'):
+            assert np.allclose(batch[key][b], single[key])
+        assert _same_modes(batch['q'][b], single['q'])
+        assert _same_modes(batch['x'][b], single['x'])
+    # the substitutions do change the frequencies
+    assert not np.allclose(batch['omega'][0], batch['omega'][1])
+
+
+def test_get_vibinfo_batch_of_hessians(model):
+    hess, geom = model
+    batch = findif.get_vibinfo_batch(np.stack([hess, 1.5 * hess]), geom, MASSES)
+    assert np.allclose(batch['omega'][1], np.sqrt(1.5) * batch['omega'][0])
+
+
+def test_off_center_of_mass(model):
+    hess, geom = model
+    # off the center of mass, but the components of the shift sum to zero
+    shifted = geom + [-0.1, 0.1, 0.0]
+    with pytest.raises(ValueError):
+        findif.get_vibinfo(hess, shifted, MASSES)
@@ -0,0 +1,48 @@
+"""
+Job sets made by optrotvib.generate
+"""
+
+import json
+
+import numpy as np
+
+from optrotvib.generate import generate_screened_jobs
+from optrotvib.molecule import Molecule
+from optrotvib.stencil import Stencil, mode_name
+
+WATER = """
+O 0.000000 0.000000 0.117790
+H 0.000000 0.755453 -0.471161
+H 0.000000 -0.755453 -0.471161
+"""
+
+
+def _cheap_job_set(job_set_dir, stencil, curvature):
+    # rotations at each geometry of a stencil whose modes have the second derivatives `curvature`
+    rotations = {'eq': 10.0}
+    for imode in range(stencil.nmode):
+        for isign in range(2):
+            rotations[mode_name(imode, isign)] = 10.0 + 0.5 * curvature[imode] * stencil.step_sizes[imode]**2
+    for name, value in rotations.items():
+        job_dir = job_set_dir / name
+        job_dir.mkdir(parents=True)
+        result = {'success': True, 'output': {'rotations': [{'wavelength': 589, 'gauge': 'LG', 'value': value}]}}
+        (job_dir / 'output.json').write_text(json.dumps(result))
+
+
+def test_screened_jobs_leave_the_stencil_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    x = np.linalg.qr(np.random.default_rng(7).normal(size=(9, 3)))[0]
+    vibinfo = {'omega': np.array([1600.0, 3700.0, 3800.0]), 'mu': np.ones(3), 'x': x}
+    stencil = Stencil(Molecule(WATER), vibinfo, [0.05, 0.05, 0.05])
+    _cheap_job_set(tmp_path / 'cheap', stencil, [100.0, 1.0, 1.0])
+    job_spec = {'program': 'psi4', 'method': 'cc2', 'basis': 'aug-cc-pvdz', 'driver': 'rotation'}
+
+    job_set_dir, jobs, screened = generate_screened_jobs(stencil, tmp_path / 'cheap', job_spec, 'target', threshold=0.9)
+    assert screened.screened == {1, 2}
+    assert [job['name'] for job in jobs] == ['eq', 'mode0_p', 'mode0_m']
+    assert stencil.screened == set()
+
+    # the job set is there already, nothing is made and nothing is screened
+    assert generate_screened_jobs(stencil, tmp_path / 'cheap', job_spec, 'target', threshold=0.9) is False
+    assert stencil.screened == set()
@@ -0,0 +1,32 @@
+"""
+Hessians from Cartesian gradient stencils with symmetry images, checked against the spring model force field
+"""
+
+import numpy as np
+import pytest
+
+from model_potential import H2O2, WATER, Springs
+from optrotvib import findif
+from optrotvib.molecule import Molecule
+from optrotvib.stencil import Stencil
+
+
+@pytest.mark.parametrize("mol_str, point_group, ncomputed", [(WATER, "C2v", 9), (H2O2, "C2", 12)])
+def test_cartesian_images(mol_str, point_group, ncomputed):
+    mol = Molecule(mol_str)
+    assert mol.point_group() == point_group
+    springs = Springs(mol)
+    stencil = Stencil.cartesian(mol, step=0.005, use_symmetry=True)
+    natom = mol.geometry.shape[0]
+    assert len(stencil.mode_names()) == ncomputed
+    assert len(stencil.mode_names()) + len(stencil.images) == 6 * natom
+
+    explicit = np.array([[springs.gradient(stencil.geometries[k, s]) for s in range(2)] for k in range(stencil.nmode)])
+    grads = np.full_like(explicit, np.nan)
+    for k, s in {(k, s) for k in range(stencil.nmode) for s in range(2)} - set(stencil.images):
+        grads[k, s] = explicit[k, s]
+    stencil.fill_vector_images(grads)
+    assert np.allclose(grads, explicit, atol=1.0e-12)
+
+    hess = findif.hessian_from_gradients(grads.reshape(stencil.nmode, 2, -1), stencil.step_sizes)
+    assert np.allclose(hess, springs.hessian(mol.geometry), atol=1.0e-5)
@@ -0,0 +1,33 @@
+"""
+optrotvib.local_submit.LocalExecutor as a drop-in for the PBS submission functions
+"""
+
+import json
+from pathlib import Path
+
+from optrotvib import submit
+from optrotvib.local_submit import LocalExecutor
+
+
+def test_submit_array(tmp_path, monkeypatch):
+    # the engine runs in the job directories, where this tree may not be importable otherwise
+    monkeypatch.setenv('PYTHONPATH', str(Path(__file__).resolve().parent.parent))
+    executor = LocalExecutor(cores_per_job=1, total_cores=2)
+    # an unknown program, the engine only writes the error
+    jobs = [{'name': name, '_id': name, 'modelchem': {'program': 'none'}} for name in ('eq', 'mode0_p', 'mode0_m')]
+    try:
+        assert executor.submit_array([], '', tmp_path, []) is None
+        array_jid = executor.submit_array([], '', tmp_path, jobs)
+        assert isinstance(array_jid, str)
+        assert (tmp_path / 'array.id').read_text() == array_jid
+        assert executor.wait() == {submit.array_element_id(array_jid, i): 0 for i in range(len(jobs))}
+    finally:
+        executor.shutdown()
+
+    assert executor.check_array(array_jid, len(jobs)) == {0: 'C', 1: 'C', 2: 'C'}
+    for i, job in enumerate(jobs):
+        job_dir = tmp_path / job['name']
+        assert (job_dir / 'job.id').read_text() == submit.array_element_id(array_jid, i)
+        assert json.loads((job_dir / 'output.json').read_text())['_id'] == job['_id']
+    dirs = [tmp_path / job['name'] for job in jobs]
+    assert executor.check_many_by_dir(dirs) == {d: 'C' for d in dirs}
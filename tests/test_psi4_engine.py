@@ -0,0 +1,62 @@
+"""
+Displaced psi4 jobs started from the equilibrium orbitals, only run where psi4 is installed
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip('psi4')
+psi4_engine = pytest.importorskip('optrotvib.engine.psi4_engine')
+
+from optrotvib.engine import cli
+from optrotvib.generate import generate_jobs_for_stencil
+from optrotvib.molecule import Molecule
+from optrotvib.stencil import Stencil
+
+WATER = """
+O 0.000000 0.000000 0.117790
+H 0.000000 0.755453 -0.471161
+H 0.000000 -0.755453 -0.471161
+"""
+
+
+def test_lower_symmetry_displacement(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('WORK', str(tmp_path))
+    stencil = Stencil.cartesian(Molecule(WATER), step=0.01)
+    job_spec = {'program': 'psi4', 'method': 'scf', 'basis': 'sto-3g', 'driver': 'gradient'}
+    job_set_dir, jobs = generate_jobs_for_stencil(stencil, job_spec, 'water_grad')
+    # a hydrogen moved in the molecular plane, C2v -> Cs
+    jobs = [job for job in jobs if job['name'] in ('eq', 'mode4_p')]
+    job_dirs = []
+    for job in jobs:
+        job_dir = job_set_dir / job['name']
+        job_dir.mkdir()
+        (job_dir / 'input.json').write_text(json.dumps(job))
+        job_dirs.append(job_dir)
+
+    psi4_engine.run_many(job_dirs, cli.finish)
+
+    for job_dir in job_dirs:
+        output_json = json.loads((job_dir / 'output.json').read_text())
+        assert output_json['success'], output_json['raw_output'].get('error')
+        assert 'gradient' in output_json['output']
+    assert (job_set_dir / 'guess_cache' / "{}.npy".format(jobs[0]['_id'])).exists()
+
+
+def test_drivers_share_one_reference(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('WORK', str(tmp_path))
+    mol = Molecule(WATER)
+    job_spec = {'program': 'psi4', 'method': 'scf', 'basis': 'sto-3g', 'driver': ['gradient', 'hessian']}
+    job_set_dir, jobs = generate_jobs_for_stencil(Stencil.cartesian(mol, step=0.01), job_spec, 'water_chain')
+    job_dir = job_set_dir / 'eq'
+    job_dir.mkdir()
+    (job_dir / 'input.json').write_text(json.dumps(jobs[0]))
+
+    psi4_engine.run_many([job_dir], cli.finish)
+
+    output_json = json.loads((job_dir / 'output.json').read_text())
+    assert output_json['success'], output_json['raw_output'].get('error')
+    assert 'gradient' in output_json['output'] and 'hessian' in output_json['output']
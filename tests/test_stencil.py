@@ -0,0 +1,86 @@
+"""
+Point groups and the symmetry images of optrotvib.stencil.Stencil, checked against model properties evaluated at
+every displaced geometry
+"""
+
+import numpy as np
+import pytest
+
+from model_potential import H2O2, HONO, WATER, Springs, pseudoscalar, scalar
+from optrotvib import findif
+from optrotvib.molecule import Molecule
+from optrotvib.stencil import Stencil
+
+ETHYLENE = """
+C 0.000000 0.000000 0.667000
+C 0.000000 0.000000 -0.667000
+H 0.000000 0.923000 1.238000
+H 0.000000 -0.923000 1.238000
+H 0.000000 0.923000 -1.238000
+H 0.000000 -0.923000 -1.238000
+"""
+
+# HONO with the hydrogen lifted out of the plane
+HONO_TWISTED = HONO.replace("-1.500000 0.950000 0.000000", "-1.500000 0.950000 0.300000")
+
+
+@pytest.mark.parametrize("mol_str, point_group, nop", [
+    (WATER, "C2v", 4), (H2O2, "C2", 2), (HONO, "Cs", 2), (HONO_TWISTED, "C1", 1), (ETHYLENE, "D2h", 8)])
+def test_symmetry_operations(mol_str, point_group, nop):
+    mol = Molecule(mol_str)
+    ops = mol.symmetry_operations()
+    assert len(ops) == nop
+    assert mol.point_group() == point_group
+    for label, matrix, atom_map in ops:
+        assert np.allclose((mol.geometry @ matrix.T)[np.argsort(atom_map)], mol.geometry, atol=1.0e-6)
+        assert [mol.symbols[i] for i in atom_map] == mol.symbols
+
+
+def _check_images(stencil, values, pseudo):
+    computed = {(k, s) for k in range(stencil.nmode) for s in range(2)} - set(stencil.images)
+    filled = np.full_like(values, np.nan)
+    for k, s in computed:
+        filled[k, s] = values[k, s]
+    stencil.fill_images(filled, pseudoscalar=pseudo)
+    assert np.allclose(filled, values, rtol=1.0e-10, atol=1.0e-12)
+
+
+def _explicit(stencil, prop):
+    symbols = stencil.eq_molecule.symbols
+    return np.array([[prop(symbols, stencil.geometries[k, s]) for s in range(2)] for k in range(stencil.nmode)])
+
+
+@pytest.mark.parametrize("mol_str, nimage", [(WATER, 1), (H2O2, 2), (HONO, 1)])
+def test_normal_mode_images(mol_str, nimage):
+    mol = Molecule(mol_str)
+    vibinfo = findif.get_vibinfo(Springs(mol).hessian(mol.geometry), mol.geometry, np.asarray(mol.masses))
+    stencil = Stencil(mol, vibinfo, np.full(len(vibinfo['omega']), 0.05), use_symmetry=True)
+    assert len(stencil.images) == nimage
+    assert all(isign == 1 and jmode == imode for (imode, isign), (jmode, _, _, _) in stencil.images.items())
+
+    _check_images(stencil, _explicit(stencil, scalar), False)
+    _check_images(stencil, _explicit(stencil, pseudoscalar), True)
+
+
+def test_pseudoscalar_sign_under_reflection():
+    mol = Molecule(HONO)
+    vibinfo = findif.get_vibinfo(Springs(mol).hessian(mol.geometry), mol.geometry, np.asarray(mol.masses))
+    stencil = Stencil(mol, vibinfo, np.full(len(vibinfo['omega']), 0.05), use_symmetry=True)
+    # the torsion is only mapped onto itself by the mirror plane
+    (imode, isign), (jmode, jsign, matrix, _) = next(iter(stencil.images.items()))
+    assert np.linalg.det(matrix) < 0
+
+    values = _explicit(stencil, pseudoscalar)
+    assert abs(values[imode, isign]) > 1.0e-6
+    assert np.isclose(values[imode, isign], -values[jmode, jsign])
+    _check_images(stencil, values, True)
+    with pytest.raises(AssertionError):
+        _check_images(stencil, values, False)
+
+
+def test_cartesian_images():
+    # improper and proper images, hydrogens exchanged by both
+    stencil = Stencil.cartesian(Molecule(WATER), step=0.01, use_symmetry=True)
+    assert any(np.linalg.det(image[2]) < 0 for image in stencil.images.values())
+    _check_images(stencil, _explicit(stencil, scalar), False)
+    _check_images(stencil, _explicit(stencil, pseudoscalar), True)
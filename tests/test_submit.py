@@ -0,0 +1,115 @@
+"""
+Job state polling of optrotvib.submit against the stand-in qstat in fake_qstat.py
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+from optrotvib import submit
+
+FAKE_QSTAT = Path(__file__).resolve().parent / 'fake_qstat.py'
+
+
+class FakeQstat(object):
+    def __init__(self, tmp_path, monkeypatch):
+        self.states_path = tmp_path / 'states.json'
+        self.log_path = tmp_path / 'qstat.log'
+        monkeypatch.setenv('FAKE_QSTAT_STATES', str(self.states_path))
+        monkeypatch.setenv('FAKE_QSTAT_LOG', str(self.log_path))
+
+    def set_states(self, states):
+        self.states_path.write_text(json.dumps(states))
+
+    def ncall(self):
+        if not self.log_path.exists():
+            return 0
+        return len(self.log_path.read_text().splitlines())
+
+
+@pytest.fixture
+def qstat(tmp_path, monkeypatch):
+    fake = FakeQstat(tmp_path, monkeypatch)
+    cache = submit.JobStateCache(ttl=60, command="{} {}".format(sys.executable, FAKE_QSTAT))
+    monkeypatch.setattr(submit, 'state_cache', cache)
+    return fake
+
+
+def _job_dirs(root, jids):
+    dirs = []
+    for i, jid in enumerate(jids):
+        job_dir = root / "job{}".format(i)
+        job_dir.mkdir()
+        (job_dir / 'job.id').write_text(jid)
+        dirs.append(job_dir)
+    return dirs
+
+
+def test_check_many_by_dir(qstat, tmp_path):
+    qstat.set_states({'101': 'R', '102': 'Q'})
+    dirs = _job_dirs(tmp_path, ['101', '102', '103'])
+    states = submit.check_many_by_dir(dirs)
+    assert [states[d] for d in dirs] == ['R', 'Q', 'C']
+    # one listing, and one recheck for the job missing from it
+    assert qstat.ncall() == 2
+    assert [submit.check_by_dir(d) for d in dirs] == ['R', 'Q', 'C']
+    assert qstat.ncall() == 2
+
+
+def test_check_array(qstat):
+    qstat.set_states({'555[0]': 'C', '555[1]': 'R', '555[2]': 'Q'})
+    assert submit.check_array('555[]', 4) == {0: 'C', 1: 'R', 2: 'Q', 3: 'C'}
+
+
+def test_ttl_expiry(qstat):
+    qstat.set_states({'101': 'Q'})
+    assert submit.check_by_id('101') == 'Q'
+    qstat.set_states({'101': 'R'})
+    assert submit.check_by_id('101') == 'Q'
+    assert qstat.ncall() == 1
+    submit.state_cache.ttl = 0
+    submit.state_cache._attempt -= 1
+    assert submit.check_by_id('101') == 'R'
+    assert qstat.ncall() == 2
+
+
+def test_job_submitted_after_listing(qstat):
+    qstat.set_states({'101': 'R'})
+    assert submit.check_by_id('101') == 'R'
+    qstat.set_states({'101': 'R', '102': 'Q'})
+    assert submit.check_by_id('102') == 'Q'
+
+
+def test_invalidate(qstat):
+    qstat.set_states({'101': 'R'})
+    assert submit.check_by_id('101') == 'R'
+    qstat.set_states({'101': 'C'})
+    submit.state_cache.invalidate()
+    assert submit.check_by_id('101') == 'C'
+
+
+def test_qstat_unreachable(qstat):
+    # never had a listing, nothing can be called complete
+    assert submit.check_by_id('101') == 'Q'
+    assert submit.check_by_id('102') == 'Q'
+    # and the failing server is not asked again before the ttl is up
+    assert qstat.ncall() == 1
+
+
+def test_submit_array_nothing_to_run(tmp_path, monkeypatch):
+    def qsub(*args, **kwargs):
+        raise AssertionError("qsub called for an empty job set")
+    monkeypatch.setattr(submit, 'qsub', qsub)
+    assert submit.submit_array([], '', tmp_path, []) is None
+
+
+def test_scripts_run_the_engine_module(tmp_path):
+    env = ['#PBS -l nodes=1:ppn=4', 'module load psi4']
+    submit.write_submit_script(env, tmp_path)
+    submit.write_array_script(env, tmp_path, ['eq', 'mode0_p'])
+    for script in ('submit.pbs', submit.ARRAY_SCRIPT):
+        last = (tmp_path / script).read_text().splitlines()[-1]
+        assert last == "python -m optrotvib.engine.cli"
+    assert (tmp_path / submit.ARRAY_LIST).read_text() == "eq\nmode0_p\n"